@@ -23,6 +23,8 @@
 import getpass
 import os
 import shutil
+import site
+import sys
 from urllib import urlencode
 from urllib2 import urlopen
 import xml.etree.ElementTree as etree
@@ -271,6 +273,203 @@ def test_default_csw_connections():
             raise ValueError('root element should be csw:Capabilities')
 
 
+@task
+@cmdopts([
+    ('url=', 'u', 'CSW endpoint to harvest'),
+    ('database=', 'd', 'record store (~/.qgis2/MetaSearch/records.db)'),
+    ('pagesize=', 'p', 'records per GetRecords request (default 50)'),
+    ('restart', 'r', 'start from scratch instead of syncing'),
+    ('reconcile', 'c', 'remove records deleted from the CSW')
+])
+def harvest():
+    """harvest or sync a CSW into a local record store"""
+
+    url = options.get('url', False)
+    if not url:
+        raise ValueError('CSW URL required')
+
+    database = options.get('database', '%s/.qgis2/MetaSearch/records.db' %
+                           USERDIR)
+    pagesize = int(options.get('pagesize', 50))
+
+    site.addsitedir(options.base.ext_libs)
+    sys.path.insert(0, options.base.plugin.parent)
+    from owslib.csw import CatalogueServiceWeb
+    from MetaSearch.store import reconcile, RecordStore, sync
+
+    def report(progress):
+        info('%(harvested)d of %(matches)d records' % progress)
+
+    catalog = CatalogueServiceWeb(url)
+    store = RecordStore(database)
+    try:
+        if options.get('restart', False):
+            store.clear(url)
+        count, changed = sync(catalog, store, pagesize, report)
+        info('%d records stored, %d new or changed' % (count, changed))
+        if options.get('reconcile', False):
+            info('Removed %d deleted records' %
+                 reconcile(catalog, store, callback=report))
+    finally:
+        store.close()
+
+
+@task
+@cmdopts([
+    ('file=', 'f', 'XML document to pretty print'),
+    ('size=', 's', 'size in MB of a generated GetRecords response (20)'),
+    ('skip-minidom', 'm', 'do not time xml.dom.minidom')
+])
+def benchmark_prettify():
+    """time the XML pretty printer against xml.dom.minidom"""
+
+    import time
+
+    sys.path.insert(0, options.base.plugin.parent)
+    from MetaSearch.prettyxml import pretty_xml
+
+    filename = options.get('file', False)
+    if filename:
+        with open(filename, 'rb') as fileobj:
+            xml = fileobj.read()
+    else:
+        record = (
+            '<csw:Record><dc:identifier>%(id)s</dc:identifier>'
+            '<dc:title>Record %(id)s</dc:title><dc:type>dataset</dc:type>'
+            '<dc:subject>benchmark</dc:subject><dct:abstract>Abstract of '
+            'record %(id)s &amp; more</dct:abstract><dct:references '
+            'scheme="OGC:WMS">http://example.org/wms?map=%(id)s'
+            '</dct:references>'
+            '<ows:BoundingBox crs="urn:ogc:def:crs:EPSG:6.6:4326">'
+            '<ows:LowerCorner>-90 -180</ows:LowerCorner><ows:UpperCorner>90 '
+            '180</ows:UpperCorner></ows:BoundingBox></csw:Record>')
+        size = float(options.get('size', 20)) * 1024 * 1024
+        records = []
+        length = 0
+        while length < size:
+            records.append(record % {'id': len(records)})
+            length += len(records[-1])
+        xml = ''.join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<csw:GetRecordsResponse '
+            'xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            'xmlns:dct="http://purl.org/dc/terms/" '
+            'xmlns:ows="http://www.opengis.net/ows"><csw:SearchResults>',
+            ''.join(records),
+            '</csw:SearchResults></csw:GetRecordsResponse>'])
+        records = None
+
+    info('Input: %.1f MB' % (len(xml) / 1048576.0))
+
+    start = time.time()
+    pretty = pretty_xml(xml)
+    info('prettyxml: %.2f s' % (time.time() - start))
+
+    if not options.get('skip_minidom', False):
+        from xml.dom.minidom import parseString
+        start = time.time()
+        expected = parseString(xml).toprettyxml()
+        info('minidom: %.2f s' % (time.time() - start))
+        if pretty != expected:
+            error('Output differs from minidom')
+
+
+@task
+@cmdopts([
+    ('python=', 'p', 'Python with PyQt4 and QGIS (default: this one)')
+])
+def benchmark_startup():
+    """time plugin import and initGui as QGIS startup would run them
+
+    The import time of the libraries the plugin defers to its first run is
+    reported first, this part needs no QGIS.
+    """
+
+    import subprocess
+
+    python = options.get('python', sys.executable)
+
+    # run in fresh interpreters so that nothing is imported yet
+    deferred = """
+import site
+import time
+
+site.addsitedir(%r)
+start = time.time()
+import jinja2, pygments.formatters, pygments.lexers
+import owslib.csw, owslib.wcs, owslib.wfs, owslib.wms, owslib.wmts
+print('deferred libraries: %%.3f s' %% (time.time() - start))
+""" % str(options.base.ext_libs)
+
+    if subprocess.call([python, '-c', deferred]) != 0:
+        error('Deferred library benchmark failed')
+
+    script = """
+import sys
+import time
+
+sys.path.insert(0, %r)
+start = time.time()
+import MetaSearch.plugin
+print('import: %%.3f s' %% (time.time() - start))
+
+from qgis.core import QgsApplication
+app = QgsApplication([], False)
+
+
+class Interface(object):
+    def __getattr__(self, name):
+        return lambda *args: None
+
+start = time.time()
+plugin = MetaSearch.plugin.MetaSearchPlugin(Interface())
+plugin.initGui()
+print('initGui: %%.3f s' %% (time.time() - start))
+print('loaded: %%s' %% (', '.join(sorted(set(
+    name.split('.')[0] for name in sys.modules
+    if name.split('.')[0] in ('jinja2', 'owslib', 'pygments')))) or 'none'))
+
+start = time.time()
+import MetaSearch.dialogs.maindialog
+print('first run import: %%.3f s' %% (time.time() - start))
+""" % str(options.base.plugin.parent)
+
+    if subprocess.call([python, '-c', script]) != 0:
+        error('Startup benchmark failed')
+
+
+@task
+@cmdopts([
+    ('file=', 'f', 'connections file to import'),
+    ('policy=', 'p', 'existing names: skip (default), overwrite or rename')
+])
+def import_connections():
+    """add the CSW connections of a file to the QGIS settings"""
+
+    filename = options.get('file', False)
+    if not filename:
+        raise ValueError('connections file required')
+
+    policy = options.get('policy', 'skip')
+    if policy not in ('skip', 'overwrite', 'rename'):
+        raise ValueError('policy must be skip, overwrite or rename')
+
+    site.addsitedir(options.base.ext_libs)
+    sys.path.insert(0, options.base.plugin.parent)
+    from PyQt4.QtCore import QCoreApplication
+    from MetaSearch.connections import ConnectionRegistry, read_connections
+
+    # the settings of QGIS itself
+    QCoreApplication.setOrganizationName('QGIS')
+    QCoreApplication.setApplicationName('QGIS2')
+
+    registry = ConnectionRegistry()
+    result = registry.import_connections(read_connections(filename), policy)
+    info('%(added)d added, %(overwritten)d overwritten, %(renamed)d renamed, '
+         '%(skipped)d skipped in %(seconds).2f s' % result)
+
+
 def sphinx_make():
     """return what command Sphinx is using for make"""
 
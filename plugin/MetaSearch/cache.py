@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+from collections import OrderedDict
+import copy
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from owslib.csw import CatalogueServiceWeb
+from owslib.etree import etree
+from owslib.fes import FilterRequest
+
+from MetaSearch import httppool
+
+LOGGER = logging.getLogger('MetaSearch')
+
+
+class CapabilitiesCache(object):
+    """per-URL cache of connected CatalogueServiceWeb instances"""
+
+    def __init__(self, ttl=3600):
+        """init, ttl is the lifetime of an entry in seconds"""
+
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=10):
+        """return the cached catalogue for url, connecting if needed"""
+
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry[1]
+
+        LOGGER.debug('Fetching capabilities: %s', url)
+        with httppool.pooled():
+            catalog = CatalogueServiceWeb(url, timeout=timeout)
+        with self._lock:
+            self._entries[url] = (time.time(), catalog)
+        return catalog
+
+    def connect(self, url, timeout=10):
+        """return a private copy of the cached catalogue for url
+
+        Requests mutate the catalogue they are run against, so every search
+        gets its own shallow copy sharing the parsed capabilities.  timeout
+        applies to the requests run against the copy.
+        """
+
+        catalog = copy.copy(self.get(url, timeout))
+        catalog.timeout = timeout
+        return catalog
+
+    def refresh(self, url):
+        """drop url from the cache so the next access reconnects"""
+
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def clear(self):
+        """drop all cached capabilities"""
+
+        with self._lock:
+            self._entries.clear()
+
+
+class LRUCache(object):
+    """thread-safe least recently used cache with TTL-based expiry"""
+
+    def __init__(self, maxsize=50, ttl=600):
+        """init, maxsize is the number of entries, ttl their lifetime"""
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return the value cached for key, or None"""
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def contains(self, key):
+        """whether key is cached, without touching the hit/miss counters"""
+
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def put(self, key, value):
+        """cache value under key, evicting the least recently used entry"""
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """drop all entries"""
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """return cache usage counters"""
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries)}
+
+    def _lookup(self, key):
+        """return a live entry and mark it as recently used (needs lock)"""
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.ttl:  # expired
+            return None
+        self._entries[key] = entry
+        return entry[1]
+
+
+class DiskCache(object):
+    """documents cached in files, by key, with TTL-based expiry
+
+    Used for OWS capabilities, so that adding a service seen before needs
+    no GetCapabilities request.
+    """
+
+    def __init__(self, directory, ttl=86400):
+        """init, ttl is the lifetime of an entry in seconds"""
+
+        self.directory = directory
+        self.ttl = ttl
+
+    def get(self, key):
+        """return the document cached for key, or None"""
+
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                return None
+            with open(path, 'rb') as fileobj:
+                return fileobj.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, key, document):
+        """cache document under key"""
+
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            # write a temporary file first, readers never see partial files
+            handle, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(handle, 'wb') as fileobj:
+                fileobj.write(document)
+            path = self._path(key)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError), err:
+            LOGGER.debug('Cannot cache %s: %s', key, err)
+
+    def remove(self, key):
+        """drop the document cached for key"""
+
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _path(self, key):
+        """return the file holding key"""
+
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.directory,
+                            '%s.xml' % hashlib.md5(key).hexdigest())
+
+
+def constraints_key(constraints):
+    """return a hashable, normalized form of a list of OWSLib constraints"""
+
+    if not constraints:
+        return ''
+    return etree.tostring(FilterRequest().setConstraintList(constraints))
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""in-memory registry of the configured CSW connections"""
+
+from bisect import bisect_left
+import logging
+import time
+from xml.etree.cElementTree import iterparse
+
+from PyQt4.QtCore import QSettings
+from PyQt4.QtGui import QMessageBox, QStringListModel
+
+LOGGER = logging.getLogger('MetaSearch')
+
+# what to do with imported connections whose name exists already
+SKIP, OVERWRITE, RENAME = 'skip', 'overwrite', 'rename'
+
+# the registry shared by the whole plugin, see get_registry()
+REGISTRY = None
+
+
+class ConnectionRegistry(object):
+    """CSW connections, read from QSettings once and kept in memory
+
+    The connection names are kept sorted in a QStringListModel, which views
+    such as combo boxes share; its signals notify them of every change.
+    Changes are written through to QSettings.
+    """
+
+    def __init__(self):
+        """init"""
+
+        self.settings = QSettings()
+        self.model = QStringListModel()
+        self.names = []  # sorted, the rows of self.model
+        self.urls = {}
+        self.reload()
+
+    def reload(self):
+        """read all connections from QSettings"""
+
+        self.settings.beginGroup('/MetaSearch/')
+        names = sorted(self.settings.childGroups())
+        self.urls = dict((name, self.settings.value('%s/url' % name))
+                         for name in names)
+        self.settings.endGroup()
+
+        self.names = names
+        self.model.setStringList(names)
+
+    def __len__(self):
+        """number of connections"""
+
+        return len(self.names)
+
+    def __contains__(self, name):
+        """whether a connection called name exists"""
+
+        return name in self.urls
+
+    def url(self, name):
+        """return the URL of a connection, or None"""
+
+        return self.urls.get(name)
+
+    def index(self, name):
+        """return the row of a connection in the model, or -1"""
+
+        row = bisect_left(self.names, name)
+        if row < len(self.names) and self.names[row] == name:
+            return row
+        return -1
+
+    def set_url(self, name, url):
+        """add a connection, or change the URL of an existing one"""
+
+        self.settings.setValue('/MetaSearch/%s/url' % name, url)
+
+        if name not in self.urls:
+            row = bisect_left(self.names, name)
+            self.names.insert(row, name)
+            self.model.insertRows(row, 1)
+            self.model.setData(self.model.index(row), name)
+        self.urls[name] = url
+
+    def remove(self, name):
+        """delete a connection"""
+
+        self.settings.remove('/MetaSearch/%s' % name)
+
+        row = self.index(name)
+        if row != -1:
+            del self.names[row]
+            del self.urls[name]
+            self.model.removeRows(row, 1)
+
+    def import_connections(self, connections, policy=SKIP):
+        """add many connections at once
+
+        connections is an iterable of (name, URL) pairs.  Names which exist
+        already, or occur earlier in connections, are skipped, overwritten or
+        imported under a new name depending on policy.  All URLs are written
+        in one pass and the model is reset once.  Returns a dict of counts
+        and the time taken in seconds.
+        """
+
+        start = time.time()
+        result = {'added': 0, 'overwritten': 0, 'renamed': 0, 'skipped': 0}
+
+        names = set(self.urls)
+        writes = []
+        for name, url in connections:
+            if not name or not url:
+                result['skipped'] += 1
+                continue
+            if name in names:
+                if policy == SKIP:
+                    result['skipped'] += 1
+                    continue
+                elif policy == RENAME:
+                    name = unique_name(name, names)
+                    result['renamed'] += 1
+                else:
+                    result['overwritten'] += 1
+            else:
+                result['added'] += 1
+            names.add(name)
+            writes.append((name, url))
+
+        self.settings.beginGroup('/MetaSearch/')
+        for name, url in writes:
+            self.settings.setValue('%s/url' % name, url)
+        self.settings.endGroup()
+        self.settings.sync()
+
+        added = len(names) != len(self.urls)
+        self.urls.update(writes)
+        if added:
+            self.names = sorted(self.urls)
+            self.model.setStringList(self.names)
+
+        result['seconds'] = time.time() - start
+        LOGGER.debug('Imported connections in %.3f s: %s',
+                     result['seconds'], result)
+        return result
+
+    def conflicts(self, names):
+        """return the names which exist already"""
+
+        return set(names).intersection(self.urls)
+
+
+def unique_name(name, names):
+    """return name with the lowest free ' (n)' suffix"""
+
+    number = 2
+    while '%s (%d)' % (name, number) in names:
+        number += 1
+    return '%s (%d)' % (name, number)
+
+
+def read_connections(filename):
+    """return the (name, URL) pairs of a connections file
+
+    The file is parsed in a single streaming pass, each <csw> element is
+    discarded as soon as its attributes are read.  Raises SyntaxError if
+    the file is not well-formed and ValueError if it is not a connections
+    file.
+    """
+
+    connections = []
+    root = None
+    for event, elem in iterparse(filename, events=('start', 'end')):
+        if root is None:
+            root = elem
+            if root.tag != 'qgsCSWConnections':
+                raise ValueError('Invalid CSW connections XML: %s' % filename)
+        elif event == 'end' and elem.tag == 'csw':
+            connections.append((elem.get('name'), elem.get('url')))
+            root.clear()
+    return connections
+
+
+def ask_policy(parent, title, conflicts):
+    """ask once what to do with existing connections
+
+    Returns SKIP, OVERWRITE or RENAME, or None to cancel the import.
+    """
+
+    names = sorted(conflicts)
+    if len(names) > 10:
+        names = names[:10] + ['...']
+
+    msg = parent.tr('%d connections exist already:\n\n%s\n\nOverwrite '
+                    'them, skip them or import them under a new name?')
+    box = QMessageBox(QMessageBox.Warning, title,
+                      msg % (len(conflicts), '\n'.join(names)),
+                      QMessageBox.Cancel, parent)
+    buttons = {
+        box.addButton(parent.tr('Overwrite'), QMessageBox.AcceptRole):
+            OVERWRITE,
+        box.addButton(parent.tr('Skip'), QMessageBox.AcceptRole): SKIP,
+        box.addButton(parent.tr('Rename'), QMessageBox.AcceptRole): RENAME
+    }
+    box.exec_()
+    return buttons.get(box.clickedButton())
+
+
+def get_registry():
+    """return the ConnectionRegistry shared by the whole plugin"""
+
+    global REGISTRY
+
+    if REGISTRY is None:
+        REGISTRY = ConnectionRegistry()
+    return REGISTRY
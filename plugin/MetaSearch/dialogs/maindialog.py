@@ -28,19 +28,27 @@
 #
 ###############################################################################
 
+import copy
+from functools import partial
+import hashlib
 import json
+import logging
 import os.path
+import Queue
+import threading
+import time
 
-from PyQt4.QtCore import QSettings, Qt, SIGNAL, SLOT
-from PyQt4.QtGui import (QApplication, QColor, QCursor, QDialog, QMessageBox,
+from PyQt4.QtCore import QSettings, Qt, QTimer, SIGNAL, SLOT
+from PyQt4.QtGui import (QApplication, QColor, QCursor, QDialog,
+                         QListWidgetItem, QMessageBox, QTextCursor,
                          QTreeWidgetItem, QWidget)
+import sip
 
-from qgis.core import (QgsApplication, QgsCoordinateReferenceSystem,
-                       QgsCoordinateTransform, QgsGeometry, QgsPoint,
+from qgis.core import (QgsApplication, QgsGeometry, QgsPoint,
                        QgsProviderRegistry)
 from qgis.gui import QgsRubberBand
 
-from owslib.csw import CatalogueServiceWeb
+from owslib.etree import etree
 from owslib.fes import BBox, PropertyIsLike
 from owslib.ows import ExceptionReport
 from owslib.wcs import WebCoverageService
@@ -48,13 +56,39 @@ from owslib.wfs import WebFeatureService
 from owslib.wms import WebMapService
 from owslib.wmts import WebMapTileService
 
+from MetaSearch import httppool
+from MetaSearch.cache import (CapabilitiesCache, constraints_key, DiskCache,
+                              LRUCache)
+from MetaSearch.connections import ask_policy, get_registry, SKIP
 from MetaSearch.dialogs.manageconnectionsdialog import ManageConnectionsDialog
 from MetaSearch.dialogs.newconnectiondialog import NewConnectionDialog
 from MetaSearch.dialogs.recorddialog import RecordDialog
 from MetaSearch.dialogs.xmldialog import XMLDialog
-from MetaSearch.util import (get_connections_from_file, highlight_xml,
-                             render_template, StaticContext)
+from MetaSearch.footprints import (FootprintLayer, project_bboxes,
+                                   TransformCache)
+from MetaSearch.services import record_services
+from MetaSearch.store import LocalCatalogue, reconcile, RecordStore, sync
+from MetaSearch.streaming import fetch_response, getrecords
+from MetaSearch.util import (format_xml, get_connections_from_file,
+                             get_context, render_template)
 from MetaSearch.ui.maindialog import Ui_MetaSearchDialog
+from MetaSearch.workers import TaskManager
+
+LOGGER = logging.getLogger('MetaSearch')
+
+# element set of result lists, full records are fetched on demand
+LIST_ESN = 'brief'
+
+# cmbFootprints entries
+FOOTPRINTS_SELECTED, FOOTPRINTS_PAGE, FOOTPRINTS_ALL = range(3)
+
+# OWSLib clients able to read each type of service, tried concurrently
+OWS_CLIENTS = {
+    'OGC:WMS/OGC:WMTS': [('wms', WebMapService), ('wmts', WebMapTileService)],
+    'OGC:WFS': [('wfs', WebFeatureService)],
+    # TODO: remove version once OWSLib defaults to 1.0.0
+    'OGC:WCS': [('wcs', partial(WebCoverageService, version='1.0.0'))]
+}
 
 
 class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
@@ -70,23 +104,91 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         self.settings = QSettings()
         self.catalog = None
         self.catalog_url = None
-        self.context = StaticContext()
+        self.catalogs = {}  # catalogues of the records on display, by URL
+        self.context = get_context()
+        self.tasks = TaskManager()
+        # the search or page on display, superseded ones are dropped
+        self.search_tasks = TaskManager(2)
+        self.search_id = 0  # discards responses of superseded searches
+        self.caps_cache = CapabilitiesCache(
+            self.settings.value('/MetaSearch/capabilitiesTTL', 3600, int))
+
+        # federated search
+        self.federated_tasks = TaskManager(
+            self.settings.value('/MetaSearch/federatedWorkers', 4, int))
+        self.federated = {}
+
+        # result pages by catalogue, constraints, offset, size and esn
+        self.page_cache = LRUCache(
+            self.settings.value('/MetaSearch/pageCacheSize', 50, int),
+            self.settings.value('/MetaSearch/pageCacheTTL', 600, int))
+        self.query_url = None
+        self.query_name = None
+        self.constraints_key = ''
+
+        # speculative paging of the current query
+        self.prefetch_tasks = TaskManager(2)
+        self.query_id = 0  # discards prefetched pages of previous searches
+        self.prefetching = set()
+        self.pending_page = None
+
+        # full records by (catalogue URL, identifier), fetched on demand
+        self.record_cache = LRUCache(
+            self.settings.value('/MetaSearch/recordCacheSize', 500, int),
+            self.settings.value('/MetaSearch/recordCacheTTL', 3600, int))
+        self.record_tasks = TaskManager(
+            self.settings.value('/MetaSearch/recordWorkers', 4, int))
+        self.fetching = set()
+        self.missing = set()  # requested but not returned, not asked again
+
+        # harvesting into the local record store
+        self.store_path = self.settings.value(
+            '/MetaSearch/recordStore',
+            os.path.join(QgsApplication.qgisSettingsDirPath(), 'MetaSearch',
+                         'records.db'))
+        self.harvest_tasks = TaskManager()  # not held up by other work
+        self.harvest_stop = None  # set while a harvest is running
+        self.record_store = None  # opened on the first offline search
+        self.offline_query = (None, None)  # keywords and bbox
+
+        # formatted XML request / responses by MD5 of the document
+        self.xml_cache = LRUCache(
+            self.settings.value('/MetaSearch/xmlCacheSize', 10, int),
+            self.settings.value('/MetaSearch/xmlCacheTTL', 3600, int))
+        self.xml_limit = self.settings.value('/MetaSearch/xmlHighlightLimit',
+                                             512 * 1024, int)
+
+        # OWS capabilities by service type and URL, kept across sessions
+        self.ows_cache = DiskCache(
+            os.path.join(QgsApplication.qgisSettingsDirPath(), 'MetaSearch',
+                         'capabilities'),
+            self.settings.value('/MetaSearch/owsCapabilitiesTTL', 86400, int))
 
         self.rubber_band = QgsRubberBand(self.map, True)  # True = a polygon
         self.rubber_band.setColor(QColor(255, 0, 0, 75))
         self.rubber_band.setWidth(5)
+        self.transforms = TransformCache(self.map)
+        self.footprints = FootprintLayer(self.map, self.transforms)
+        self.watching_crs = False  # see watch_crs()
 
         # form inputs
         self.startfrom = 0
         self.maxrecords = 10
         self.constraints = []
 
-        # Servers tab
+        # Servers tab, both connection lists show the same registry
+        self.connections = get_registry()
+        self.cmbConnectionsServices.setModel(self.connections.model)
+        self.cmbConnectionsSearch.setModel(self.connections.model)
         self.cmbConnectionsServices.activated.connect(self.save_connection)
         self.cmbConnectionsSearch.activated.connect(self.save_connection)
         self.btnServerInfo.clicked.connect(self.connection_info)
         self.btnAddDefault.clicked.connect(self.add_default_connections)
         self.btnCapabilities.clicked.connect(self.show_xml)
+        self.btnRefreshCapabilities.clicked.connect(self.refresh_capabilities)
+        self.btnHarvest.clicked.connect(self.harvest_connection)
+        self.chkSearchAll.toggled.connect(self.populate_service_list)
+        self.lstServices.itemChanged.connect(self.save_service_selection)
         self.tabWidget.currentChanged.connect(self.populate_connection_list)
 
         # server management buttons
@@ -114,6 +216,7 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         self.btnAddToWfs.clicked.connect(self.add_to_ows)
         self.btnAddToWcs.clicked.connect(self.add_to_ows)
         self.btnShowXml.clicked.connect(self.show_xml)
+        self.cmbFootprints.currentIndexChanged.connect(self.show_footprints)
 
         self.manageGui()
 
@@ -126,8 +229,8 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         self.spnRecords.setValue(
             self.settings.value('/MetaSearch/returnRecords', 10, int))
 
-        key = '/MetaSearch/%s' % self.cmbConnectionsSearch.currentText()
-        self.catalog_url = self.settings.value('%s/url' % key)
+        self.catalog_url = self.connections.url(
+            self.cmbConnectionsSearch.currentText())
 
         self.set_bbox_global()
 
@@ -136,14 +239,11 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
     # Servers tab
 
     def populate_connection_list(self):
-        """populate select box with connections"""
+        """select the current connection and update the buttons
 
-        self.settings.beginGroup('/MetaSearch/')
-        self.cmbConnectionsServices.clear()
-        self.cmbConnectionsServices.addItems(self.settings.childGroups())
-        self.cmbConnectionsSearch.clear()
-        self.cmbConnectionsSearch.addItems(self.settings.childGroups())
-        self.settings.endGroup()
+        The select boxes show the connection registry, which keeps them up
+        to date.
+        """
 
         self.set_connection_list_position()
 
@@ -160,6 +260,54 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         self.btnServerInfo.setEnabled(state_disabled)
         self.btnEdit.setEnabled(state_disabled)
         self.btnDelete.setEnabled(state_disabled)
+        self.btnHarvest.setEnabled(state_disabled)
+
+        self.populate_service_list()
+
+    def populate_service_list(self):
+        """list the services of a federated search, if one is asked for
+
+        Services are checked unless the user unchecked them before, so new
+        connections are searched too.
+        """
+
+        checked = self.chkSearchAll.isChecked()
+        self.lstServices.setVisible(checked)
+        if not checked:
+            return
+
+        excluded = self.excluded_services()
+        self.lstServices.blockSignals(True)
+        self.lstServices.clear()
+        for name in self.connections.names:
+            item = QListWidgetItem(name, self.lstServices)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            if name in excluded:
+                item.setCheckState(Qt.Unchecked)
+            else:
+                item.setCheckState(Qt.Checked)
+        self.lstServices.blockSignals(False)
+
+    def excluded_services(self):
+        """return the names of the services left out of federated searches"""
+
+        return set(json.loads(self.settings.value(
+            '/MetaSearch/federatedExcluded', '[]')))
+
+    def save_service_selection(self):
+        """remember the services left out of federated searches"""
+
+        excluded = self.excluded_services()
+        for row in range(self.lstServices.count()):
+            item = self.lstServices.item(row)
+            if item.checkState() == Qt.Checked:
+                excluded.discard(item.text())
+            else:
+                excluded.add(item.text())
+        # forget deleted connections
+        excluded.intersection_update(self.connections.names)
+        self.settings.setValue('/MetaSearch/federatedExcluded',
+                               json.dumps(sorted(excluded)))
 
     def set_connection_list_position(self):
         """set the current index to the selected connection"""
@@ -172,13 +320,11 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             self.btnEdit.setEnabled(False)
 
         # does to_select exist in cmbConnectionsServices?
-        exists = False
-        for i in range(conn_count):
-            if self.cmbConnectionsServices.itemText(i) == to_select:
-                self.cmbConnectionsServices.setCurrentIndex(i)
-                self.cmbConnectionsSearch.setCurrentIndex(i)
-                exists = True
-                break
+        index = self.connections.index(to_select)
+        exists = index != -1
+        if exists:
+            self.cmbConnectionsServices.setCurrentIndex(index)
+            self.cmbConnectionsSearch.setCurrentIndex(index)
 
         # If we couldn't find the stored item, but there are some, default
         # to the last item (this makes some sense when deleting items as it
@@ -208,10 +354,9 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             current_text = self.cmbConnectionsSearch.currentText()
 
         self.settings.setValue('/MetaSearch/selected', current_text)
-        key = '/MetaSearch/%s' % current_text
 
         if caller == 'cmbConnectionsSearch':  # bind to service in search tab
-            self.catalog_url = self.settings.value('%s/url' % key)
+            self.catalog_url = self.connections.url(current_text)
 
         if caller == 'cmbConnectionsServices':  # clear server metadata
             self.textMetadata.clear()
@@ -220,8 +365,7 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         """show connection info"""
 
         current_text = self.cmbConnectionsServices.currentText()
-        key = '/MetaSearch/%s' % current_text
-        self.catalog_url = self.settings.value('%s/url' % key)
+        self.catalog_url = self.connections.url(current_text)
 
         # connect to the server
         if not self._get_csw():
@@ -239,6 +383,71 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             self.textMetadata.document().setDefaultStyleSheet(style)
             self.textMetadata.setHtml(metadata)
 
+    def refresh_capabilities(self):
+        """discard cached capabilities and reconnect"""
+
+        current_text = self.cmbConnectionsServices.currentText()
+        self.caps_cache.refresh(self.connections.url(current_text))
+        self.connection_info()
+
+    def harvest_connection(self):
+        """harvest or sync the current service, or stop a running one"""
+
+        if self.harvest_stop is not None:  # finishes after the current page
+            self.harvest_stop.set()
+            self.btnHarvest.setEnabled(False)
+            return
+
+        current_text = self.cmbConnectionsServices.currentText()
+        url = self.connections.url(current_text)
+
+        self.harvest_stop = threading.Event()
+        self.btnHarvest.setText(self.tr('Stop'))
+        self.progressHarvest.setValue(0)
+        self.harvest_tasks.start_streaming(
+            harvest_records, self._harvest_progress,
+            partial(self._harvest_finished, current_text),
+            partial(self._harvest_failed, current_text),
+            self.caps_cache, url, self.store_path,
+            self.settings.value('/MetaSearch/harvestPageSize', 50, int),
+            self.harvest_stop, self.chkReconcile.isChecked())
+
+    def _harvest_progress(self, progress):
+        """report the progress of a harvest"""
+
+        self.progressHarvest.setMaximum(progress['matches'])
+        self.progressHarvest.setValue(progress['harvested'])
+
+    def _harvest_finished(self, name, result):
+        """handle a completed or stopped harvest"""
+
+        count, changed, deleted = result
+        stopped = self.harvest_stop.is_set()
+        self._harvest_reset()
+        if stopped:
+            msg = self.tr('Harvest of %s stopped with %d records stored, it '
+                          'will resume from there' % (name, count))
+        else:
+            msg = self.tr('%s: %d records stored, %d new or changed, %d '
+                          'removed' % (name, count, changed, deleted))
+        QMessageBox.information(self, self.tr('Harvest'), msg)
+
+    def _harvest_failed(self, name, err):
+        """handle a failed harvest"""
+
+        self._harvest_reset()
+        QMessageBox.warning(self, self.tr('Harvest error'),
+                            self.tr('Harvest of %s failed, it will resume '
+                                    'from the last page stored: %s' %
+                                    (name, err)))
+
+    def _harvest_reset(self):
+        """return the harvest button to its idle state"""
+
+        self.harvest_stop = None
+        self.btnHarvest.setText(self.tr('Harvest'))
+        self.btnHarvest.setEnabled(True)
+
     def add_connection(self):
         """add new service"""
 
@@ -253,7 +462,7 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
 
         current_text = self.cmbConnectionsServices.currentText()
 
-        url = self.settings.value('/MetaSearch/%s/url' % current_text)
+        url = self.connections.url(current_text)
 
         conn_edit = NewConnectionDialog(current_text)
         conn_edit.setWindowTitle(self.tr('Edit Catalogue service'))
@@ -267,17 +476,12 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
 
         current_text = self.cmbConnectionsServices.currentText()
 
-        key = '/MetaSearch/%s' % current_text
-
         msg = self.tr('Remove service %s?' % current_text)
 
         result = QMessageBox.information(self, self.tr('Confirm delete'), msg,
                                          QMessageBox.Ok | QMessageBox.Cancel)
         if result == QMessageBox.Ok:  # remove service from list
-            self.settings.remove(key)
-            index_to_delete = self.cmbConnectionsServices.currentIndex()
-            self.cmbConnectionsServices.removeItem(index_to_delete)
-            self.cmbConnectionsSearch.removeItem(index_to_delete)
+            self.connections.remove(current_text)
             self.set_connection_list_position()
 
     def load_connections(self):
@@ -289,30 +493,21 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
     def add_default_connections(self):
         """add default connections"""
 
-        filename = os.path.join(self.context.ppath,
-                                'resources', 'connections-default.xml')
-        doc = get_connections_from_file(self, filename)
-        if doc is None:
+        connections = get_connections_from_file(
+            self, self.context.connections_default)
+        if connections is None:
             return
 
-        self.settings.beginGroup('/MetaSearch/')
-        keys = self.settings.childGroups()
-        self.settings.endGroup()
-
-        for server in doc.findall('csw'):
-            name = server.attrib.get('name')
-            # check for duplicates
-            if name in keys:
-                msg = self.tr('%s exists.  Overwrite?' % name)
-                res = QMessageBox.warning(self,
-                                          self.tr('Loading connections'), msg,
-                                          QMessageBox.Yes | QMessageBox.No)
-                if res != QMessageBox.Yes:
-                    continue
+        policy = SKIP
+        conflicts = self.connections.conflicts(
+            [name for name, url in connections])
+        if conflicts:
+            policy = ask_policy(self, self.tr('Loading connections'),
+                                conflicts)
+            if policy is None:
+                return
 
-            # no dups detected or overwrite is allowed
-            key = '/MetaSearch/%s' % name
-            self.settings.setValue('%s/url' % key, server.attrib.get('url'))
+        self.connections.import_connections(connections, policy)
 
         self.populate_connection_list()
         QMessageBox.information(self, self.tr('Catalogue services'),
@@ -323,15 +518,10 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
     def set_bbox_from_map(self):
         """set bounding box from map extent"""
 
-        crs = self.map.mapRenderer().destinationCrs()
-        crsid = int(crs.authid().split(':')[1])
-
         extent = self.map.extent()
+        xform = self.transforms.from_map()
 
-        if crsid != 4326:  # reproject to EPSG:4326
-            src = QgsCoordinateReferenceSystem(crsid)
-            dest = QgsCoordinateReferenceSystem(4326)
-            xform = QgsCoordinateTransform(src, dest)
+        if xform is not None:  # reproject to EPSG:4326
             minxy = xform.transform(QgsPoint(extent.xMinimum(),
                                              extent.yMinimum()))
             maxxy = xform.transform(QgsPoint(extent.xMaximum(),
@@ -360,12 +550,17 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         """execute search"""
 
         self.catalog = None
+        self.catalogs = {}
         self.constraints = []
+        self.missing = set()
+        self.record_tasks.cancel_pending()  # batches of the last results
+        self.fetching = set()
 
         # clear all fields and disable buttons
         self.lblResults.clear()
         self.treeRecords.clear()
         self.textAbstract.clear()
+        self.show_footprints()
 
         self.reset_buttons()
 
@@ -375,8 +570,7 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
 
         # set current catalogue
         current_text = self.cmbConnectionsSearch.currentText()
-        key = '/MetaSearch/%s' % current_text
-        self.catalog_url = self.settings.value('%s/url' % key)
+        self.catalog_url = self.connections.url(current_text)
 
         # start position and number of records to return
         self.startfrom = 0
@@ -389,42 +583,135 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         maxy = self.leNorth.text()
         bbox = [minx, miny, maxx, maxy]
 
+        try:
+            [float(value) for value in bbox]
+        except ValueError:
+            QMessageBox.warning(self, self.tr('Search error'),
+                                self.tr('Invalid bounding box: %s') %
+                                ', '.join(bbox))
+            return
+
         # only apply spatial filter if bbox is not global
         # even for a global bbox, if a spatial filter is applied, then
         # the CSW server will skip records without a bbox
-        if bbox != ['-180', '-90', '180', '90']:
+        if bbox == ['-180', '-90', '180', '90']:
+            bbox = None
+        else:
             self.constraints.append(BBox(bbox))
 
         # keywords
-        if self.leKeywords.text():
+        keywords = self.leKeywords.text()
+        if keywords:
             # TODO: handle multiple word searches
-            keywords = self.leKeywords.text()
             self.constraints.append(PropertyIsLike('csw:AnyText', keywords))
 
         if len(self.constraints) > 1:  # exclusive search (a && b)
             self.constraints = [self.constraints]
 
-        # build request
-        if not self._get_csw():
-            return
-
         # TODO: allow users to select resources types
         # to find ('service', 'dataset', etc.)
-        try:
-            self.catalog.getrecords2(constraints=self.constraints,
-                                     maxrecords=self.maxrecords, esn='full')
-        except ExceptionReport, err:
-            QApplication.restoreOverrideCursor()
-            QMessageBox.warning(self, self.tr('Search error'),
-                                self.tr('Search error: %s' % err))
+        self.lblResults.setText(self.tr('Searching...'))
+        self.search_id += 1
+        self.search_tasks.cancel_pending()
+        self.federated_tasks.cancel_pending()
+
+        # outstanding prefetches belong to the previous query
+        self.query_id += 1
+        self.prefetch_tasks.cancel_pending()
+        self.prefetching = set()
+        self.pending_page = None
+
+        if self.chkOffline.isChecked():
+            self.query_url = self.catalog_url
+            self.query_name = current_text
+            self.offline_query = (keywords, bbox)
+            self.search_offline()
             return
-        except Exception, err:
-            QApplication.restoreOverrideCursor()
-            QMessageBox.warning(self, self.tr('Connection error'),
-                                self.tr('Connection error: %s' % err))
+
+        if self.chkSearchAll.isChecked():
+            self.search_all()
+            return
+
+        self.query_url = self.catalog_url
+        self.query_name = current_text
+        self.constraints_key = constraints_key(self.constraints)
+        catalog = self.page_cache.get(self.page_key(0))
+        if catalog is not None:
+            self._search_finished(self.search_id, catalog, True)
+            return
+
+        # rows are added as the response is parsed
+        self.search_tasks.start_streaming(
+            get_records, partial(self._search_progress, self.search_id),
+            partial(self._search_finished, self.search_id, streamed=True),
+            partial(self._search_failed, self.search_id),
+            self.caps_cache, self.catalog_url, self.constraints, 0,
+            self.maxrecords)
+
+    def search_offline(self):
+        """run the current query against the harvested records"""
+
+        if self.record_store is None:
+            self.record_store = RecordStore(self.store_path)
+
+        if self.record_store.count(self.query_url) == 0:
+            self.lblResults.clear()
+            QMessageBox.information(
+                self, self.tr('Search'),
+                self.tr('No harvested records for %s, harvest the service '
+                        'first' % self.query_name))
+            return
+
+        keywords, bbox = self.offline_query
+        catalog = self.record_store.search(self.query_url, keywords, bbox,
+                                           self.startfrom, self.maxrecords)
+
+        # harvested records are full records already
+        for identifier, record in catalog.records.items():
+            record_services(record)
+            self.record_cache.put((catalog.url, identifier), record)
+
+        self._search_finished(self.search_id, catalog, True)
+
+    def page_key(self, startposition):
+        """return the page cache key of a page of the current query"""
+
+        return (self.query_url, self.constraints_key, startposition,
+                self.maxrecords, LIST_ESN)
+
+    def _search_progress(self, search_id, progress):
+        """add a record of a streamed search or paging request"""
+
+        if search_id != self.search_id:  # a newer request was issued
+            return
+
+        catalog, item = progress
+
+        if isinstance(item, dict):  # result summary, records follow
+            self.catalog = catalog
+            self.catalogs = {catalog.url: catalog}
+            self.treeRecords.clear()
+            self.lblResults.setText(self.tr('Loading %d of %d results' %
+                                            (item['returned'],
+                                             item['matches'])))
+        else:
+            self.add_record(item, self.query_name, catalog.url)
+
+    def _search_finished(self, search_id, catalog, cached=False,
+                         streamed=False):
+        """handle a completed search or paging request"""
+
+        if search_id != self.search_id:  # a newer request was issued
             return
 
+        self.catalog = catalog
+        self.catalogs = {catalog.url: catalog}
+        if not cached and catalog.results:
+            self.page_cache.put(self.page_key(self.startfrom), catalog)
+        LOGGER.debug('HTTP connections: %s', httppool.stats())
+
         if not self.catalog.results:
+            self.lblResults.clear()
             QMessageBox.information(self, self.tr('Search'),
                                     self.tr('No results.'))
             return
@@ -435,13 +722,92 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             self.lblResults.setText(self.tr('0 results'))
             return
 
-        QApplication.restoreOverrideCursor()
-        self.display_results()
+        self.display_results(not streamed)
 
-    def display_results(self):
-        """display search results"""
+    def _search_failed(self, search_id, err):
+        """handle a failed search or paging request"""
 
-        self.treeRecords.clear()
+        if search_id != self.search_id:  # a newer request was issued
+            return
+
+        self.lblResults.clear()
+
+        if isinstance(err, ExceptionReport):
+            QMessageBox.warning(self, self.tr('Search error'),
+                                self.tr('Search error: %s' % err))
+        else:
+            QMessageBox.warning(self, self.tr('Connection error'),
+                                self.tr('Connection error: %s' % err))
+
+    def search_all(self):
+        """send the current search to the checked services concurrently"""
+
+        names = [self.lstServices.item(row).text()
+                 for row in range(self.lstServices.count())
+                 if self.lstServices.item(row).checkState() == Qt.Checked]
+        if not names:
+            self.lblResults.clear()
+            QMessageBox.information(self, self.tr('Search'),
+                                    self.tr('No services checked'))
+            return
+
+        self.federated = {'services': len(names), 'answered': 0,
+                          'matches': 0, 'failed': []}
+        timeout = self.settings.value('/MetaSearch/federatedTimeout', 10, int)
+
+        for name in names:
+            url = self.connections.url(name)
+            self.federated_tasks.start(
+                get_records,
+                partial(self._federated_finished, self.search_id, name),
+                partial(self._federated_failed, self.search_id, name),
+                self.caps_cache, url, self.constraints, 0, self.maxrecords,
+                timeout)
+
+    def _federated_finished(self, search_id, name, catalog):
+        """add the results of one service to a federated search"""
+
+        if search_id != self.search_id:  # a newer request was issued
+            return
+
+        self.federated['answered'] += 1
+        if catalog.results:
+            self.catalogs[catalog.url] = catalog
+            self.federated['matches'] += catalog.results['matches']
+            self.add_records(catalog, name)
+            self.fetch_full_records(catalog.url)
+            self.btnShowXml.setEnabled(True)
+            self.show_footprints()
+            self.watch_crs()
+        self._federated_status()
+
+    def _federated_failed(self, search_id, name, err):
+        """record a service which failed to answer a federated search"""
+
+        if search_id != self.search_id:  # a newer request was issued
+            return
+
+        LOGGER.debug('Federated search failed for %s: %s', name, err)
+        self.federated['answered'] += 1
+        self.federated['failed'].append('%s: %s' % (name, err))
+        self._federated_status()
+
+    def _federated_status(self):
+        """report the progress of a federated search"""
+
+        msg = self.tr('Showing %d of %d results from %d of %d services' %
+                      (self.treeRecords.topLevelItemCount(),
+                       self.federated['matches'], self.federated['answered'],
+                       self.federated['services']))
+        self.lblResults.setText(msg)
+        self.lblResults.setToolTip('\n'.join(self.federated['failed']))
+
+    def display_results(self, rebuild=True):
+        """display search results, rebuild=False keeps streamed rows"""
+
+        if rebuild:
+            self.treeRecords.clear()
+            self.add_records(self.catalog, self.query_name)
 
         position = self.catalog.results['returned'] + self.startfrom
 
@@ -450,20 +816,16 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
                       self.catalog.results['matches']))
 
         self.lblResults.setText(msg)
+        stats = self.page_cache.stats()
+        self.lblResults.setToolTip(
+            self.tr('Page cache: %d hits, %d misses, %d pages' %
+                    (stats['hits'], stats['misses'], stats['size'])))
 
-        for rec in self.catalog.records:
-            item = QTreeWidgetItem(self.treeRecords)
-            if self.catalog.records[rec].type:
-                item.setText(0, self.catalog.records[rec].type)
-            else:
-                item.setText(0, 'unknown')
-            if self.catalog.records[rec].title:
-                item.setText(1, self.catalog.records[rec].title)
-            if self.catalog.records[rec].identifier:
-                set_item_data(item, 'identifier',
-                              self.catalog.records[rec].identifier)
+        offline = isinstance(self.catalog, LocalCatalogue)
+        if not offline:
+            self.fetch_full_records(self.catalog.url)
 
-        self.btnShowXml.setEnabled(True)
+        self.btnShowXml.setEnabled(not offline)
 
         if self.catalog.results["matches"] < self.maxrecords:
             disabled = False
@@ -475,6 +837,145 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         self.btnNext.setEnabled(disabled)
         self.btnLast.setEnabled(disabled)
 
+        self.show_footprints()
+        self.watch_crs()
+
+        if not offline:
+            self.prefetch_pages()
+
+    def show_footprints(self):
+        """draw the footprints of the results on a map layer"""
+
+        mode = self.cmbFootprints.currentIndex()
+        if mode == FOOTPRINTS_SELECTED:
+            self.footprints.clear()
+            return
+
+        if mode == FOOTPRINTS_ALL and isinstance(self.catalog,
+                                                 LocalCatalogue):
+            # the whole result set is one indexed query away
+            keywords, bbox = self.offline_query
+            footprints = [
+                (self.query_url,) + row for row in
+                self.record_store.footprints(self.query_url, keywords, bbox)]
+        else:  # the records on display
+            footprints = record_footprints(self.catalogs)
+
+        self.footprints.show(footprints)
+
+        item = self.treeRecords.currentItem()
+        if all([item, self.treeRecords.selectedItems(),
+                self.footprints.select(get_item_data(item, 'source'),
+                                       get_item_data(item, 'identifier'))]):
+            self.rubber_band.reset()
+
+    def watch_crs(self, watch=True):
+        """follow changes of the map CRS while results are on display"""
+
+        if watch == self.watching_crs:
+            return
+        signal = self.map.mapRenderer().destinationSrsChanged
+        if watch:
+            signal.connect(self.crs_changed)
+        else:
+            signal.disconnect(self.crs_changed)
+        self.watching_crs = watch
+
+    def crs_changed(self):
+        """redraw the footprints and the selected record in the new CRS"""
+
+        if not self.isVisible():
+            return
+
+        self.show_footprints()
+
+        item = self.treeRecords.currentItem()
+        if item and self.treeRecords.selectedItems():
+            key = (get_item_data(item, 'source'),
+                   get_item_data(item, 'identifier'))
+            record = self.record_cache.get(key)
+            if record is None:  # the brief record has the bbox too
+                record = self.get_record(item)
+            self.highlight_record(item, record)
+
+    def prefetch_pages(self):
+        """fetch the pages around the current one in the background"""
+
+        depth = self.settings.value('/MetaSearch/prefetchPages', 1, int)
+        matches = self.catalog.results['matches']
+
+        for step in range(1, depth + 1):
+            for start in [self.startfrom + step * self.maxrecords,
+                          self.startfrom - step * self.maxrecords]:
+                if any([start < 0, start >= matches,
+                        start in self.prefetching,
+                        self.page_cache.contains(self.page_key(start))]):
+                    continue
+                self.prefetching.add(start)
+                self.prefetch_tasks.start(
+                    get_page,
+                    partial(self._prefetch_finished, self.query_id, start,
+                            self.page_key(start)),
+                    partial(self._prefetch_failed, self.query_id, start),
+                    self.catalog, self.constraints, start, self.maxrecords)
+
+    def _prefetch_finished(self, query_id, start, key, catalog):
+        """keep a prefetched page, showing it if it is being waited for"""
+
+        if catalog.results:  # valid regardless of the query on display
+            self.page_cache.put(key, catalog)
+
+        if query_id != self.query_id:  # a new search was issued
+            return
+
+        self.prefetching.discard(start)
+
+        if self.pending_page == start:
+            self.pending_page = None
+            self.catalogs = {catalog.url: catalog}
+            self.catalog = catalog
+            self.display_results()
+
+    def _prefetch_failed(self, query_id, start, err):
+        """forget a failed prefetch, fetching it if it is being waited for"""
+
+        if query_id != self.query_id:  # a new search was issued
+            return
+
+        LOGGER.debug('Prefetch of page %d failed: %s', start, err)
+        self.prefetching.discard(start)
+
+        if self.pending_page == start:
+            self.pending_page = None
+            self.fetch_page()
+
+    def add_records(self, catalog, name):
+        """add the records of a catalogue to the results list"""
+
+        for rec in catalog.records:
+            self.add_record(catalog.records[rec], name, catalog.url)
+
+    def add_record(self, record, name, url):
+        """add a record to the results list"""
+
+        item = QTreeWidgetItem(self.treeRecords)
+        if record.type:
+            item.setText(0, record.type)
+        else:
+            item.setText(0, 'unknown')
+        if record.title:
+            item.setText(1, record.title)
+        item.setText(2, name)
+        if record.identifier:
+            set_item_data(item, 'identifier', record.identifier)
+        set_item_data(item, 'source', url)
+
+    def get_record(self, item):
+        """return the search result record of a results list item"""
+
+        identifier = get_item_data(item, 'identifier')
+        return self.catalogs[get_item_data(item, 'source')].records[identifier]
+
     def record_clicked(self):
         """record clicked signal"""
 
@@ -488,77 +989,127 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         if not item:
             return
 
-        identifier = get_item_data(item, 'identifier')
-        record = self.catalog.records[identifier]
+        # the results list only holds brief records
+        key = (get_item_data(item, 'source'),
+               get_item_data(item, 'identifier'))
+        record = self.record_cache.get(key)
+        if record is None and key in self.missing:
+            # the catalogue did not return it, the brief record is all there is
+            self.show_record(item, self.get_record(item))
+            return
+        if record is None:
+            self.textAbstract.setText(self.tr('Loading...'))
+            self.fetch_full_records(key[0])
+            return
+
+        self.show_record(item, record)
+
+    def fetch_full_records(self, url):
+        """fetch the full records of all listed results from a catalogue
+
+        The records are requested in batches of recordBatchSize identifiers
+        per GetRecordById request, so browsing the list afterwards needs no
+        round trips.
+        """
+
+        identifiers = []
+        for i in range(self.treeRecords.topLevelItemCount()):
+            item = self.treeRecords.topLevelItem(i)
+            key = (get_item_data(item, 'source'),
+                   get_item_data(item, 'identifier'))
+            if all([key[0] == url, key[1] is not None,
+                    key not in self.fetching, key not in self.missing,
+                    not self.record_cache.contains(key)]):
+                identifiers.append(key[1])
+                self.fetching.add(key)
+
+        batch_size = self.settings.value('/MetaSearch/recordBatchSize', 50,
+                                         int)
+        for i in range(0, len(identifiers), batch_size):
+            batch = identifiers[i:i + batch_size]
+            self.record_tasks.start(
+                get_records_by_id,
+                partial(self._full_records_finished, url, batch),
+                partial(self._full_records_failed, url, batch),
+                self.caps_cache, url, batch)
+
+    def _full_records_finished(self, url, identifiers, catalog):
+        """store fetched full records and show the selected one"""
+
+        for identifier in identifiers:
+            self.fetching.discard((url, identifier))
+            record = catalog.records.get(identifier)
+            if record is None:
+                LOGGER.debug('GetRecordById did not return %s', identifier)
+                self.missing.add((url, identifier))
+            else:
+                self.record_cache.put((url, identifier), record)
+
+        item = self.treeRecords.currentItem()
+        if all([item, self.treeRecords.selectedItems(),
+                get_item_data(item, 'source') == url,
+                get_item_data(item, 'identifier') in identifiers]):
+            self.record_clicked()
+
+    def _full_records_failed(self, url, identifiers, err):
+        """report a failed full record request"""
+
+        for identifier in identifiers:
+            self.fetching.discard((url, identifier))
+            self.missing.add((url, identifier))  # until the next search
+
+        LOGGER.debug('GetRecordById failed for %s: %s', url, err)
+
+        item = self.treeRecords.currentItem()
+        if all([item, self.treeRecords.selectedItems(),
+                get_item_data(item, 'source') == url,
+                get_item_data(item, 'identifier') in identifiers]):
+            self.textAbstract.setText(
+                self.tr('Error getting response: %s' % err))
+
+    def show_record(self, item, record):
+        """show abstract, footprint and services of a full record"""
 
         if record.abstract:
             self.textAbstract.setText(record.abstract.strip())
         else:
             self.textAbstract.setText(self.tr('No abstract'))
 
-        # if the record has a bbox, show a footprint on the map
-        if record.bbox is not None:
-            points = bbox_to_polygon(record.bbox)
-
-            src = QgsCoordinateReferenceSystem(4326)
-            dst = self.map.mapRenderer().destinationCrs()
-            ct = QgsCoordinateTransform(src, dst)
-            geom = QgsGeometry.fromPolygon(points)
-            geom.transform(ct)
-            self.rubber_band.setToGeometry(geom, None)
+        self.highlight_record(item, record)
 
         # figure out if the data is interactive and can be operated on
         self.find_services(record, item)
 
+    def highlight_record(self, item, record):
+        """highlight the footprint of a record on the map
+
+        The footprint is selected on the footprint layer if it is there, or
+        shown on its own.
+        """
+
+        self.rubber_band.reset()
+        if self.footprints.select(get_item_data(item, 'source'),
+                                  get_item_data(item, 'identifier')):
+            return
+        if record.bbox is not None:
+            points = bbox_to_polygon(record.bbox, self.transforms.to_map())
+            if points[0] is not None:
+                self.rubber_band.setToGeometry(
+                    QgsGeometry.fromPolygon(points), None)
+
     def find_services(self, record, item):
-        """scan record for WMS/WMTS|WFS|WCS endpoints"""
+        """enable the buttons of the WMS/WMTS|WFS|WCS endpoints of a record"""
 
-        links = record.uris + record.references
+        services = record_services(record)
 
-        services = {}
-        for link in links:
+        if 'wms' in services:
+            self.btnAddToWms.setEnabled(True)
+        if 'wfs' in services:
+            self.btnAddToWfs.setEnabled(True)
+        if 'wcs' in services:
+            self.btnAddToWcs.setEnabled(True)
 
-            if 'scheme' in link:
-                link_type = link['scheme']
-            elif 'protocol' in link:
-                link_type = link['protocol']
-            else:
-                link_type = None
-
-            if link_type is not None:
-                link_type = link_type.upper()
-
-            # if the link type exists, and it is one of the acceptable
-            # interactive link types, then set
-            if all([link_type is not None,
-                    link_type in ['OGC:WMS', 'OGC:WMTS',
-                                  'OGC:WMS-1.1.1-HTTP-GET-MAP',
-                                  'OGC:WMS-1.1.1-HTTP-GET-CAPABILITIES',
-                                  'OGC:WMS-1.3.0-HTTP-GET-MAP',
-                                  'OGC:WMS-1.3.0-HTTP-GET-CAPABILITIES',
-                                  'OGC:WFS',
-                                  'OGC:WFS-1.0.0-HTTP-GET-CAPABILITIES',
-                                  'OGC:WFS-1.1.0-HTTP-GET-CAPABILITIES',
-                                  'OGC:WCS',
-                                  'OGC:WCS-1.1.0-HTTP-GET-CAPABILITIES']]):
-                if link_type in ['OGC:WMS', 'OGC:WMTS',
-                                 'OGC:WMS-1.1.1-HTTP-GET-MAP',
-                                 'OGC:WMS-1.1.1-HTTP-GET-CAPABILITIES',
-                                 'OGC:WMS-1.3.0-HTTP-GET-MAP',
-                                 'OGC:WMS-1.3.0-HTTP-GET-CAPABILITIES']:
-                    services['wms'] = link['url']
-                    self.btnAddToWms.setEnabled(True)
-                if link_type in ['OGC:WFS',
-                                 'OGC:WFS-1.0.0-HTTP-GET-CAPABILITIES',
-                                 'OGC:WFS-1.1.0-HTTP-GET-CAPABILITIES']:
-                    services['wfs'] = link['url']
-                    self.btnAddToWfs.setEnabled(True)
-                if link_type in ['OGC:WCS',
-                                 'OGC:WCS-1.1.0-HTTP-GET-CAPABILITIES']:
-                    services['wcs'] = link['url']
-                    self.btnAddToWcs.setEnabled(True)
-
-            set_item_data(item, 'link', json.dumps(services))
+        set_item_data(item, 'link', json.dumps(services))
 
     def navigate(self):
         """manage navigation / paging"""
@@ -595,15 +1146,39 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             else:
                 return
 
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        self.search_id += 1
+        self.search_tasks.cancel_pending()
+        self.pending_page = None
 
-        self.catalog.getrecords2(constraints=self.constraints,
-                                 maxrecords=self.maxrecords,
-                                 startposition=self.startfrom, esn='full')
+        if isinstance(self.catalog, LocalCatalogue):  # no network needed
+            self.search_offline()
+            return
 
-        QApplication.restoreOverrideCursor()
+        catalog = self.page_cache.get(self.page_key(self.startfrom))
+        if catalog is not None:  # seen before or prefetched
+            self.catalog = catalog
+            self.catalogs = {catalog.url: catalog}
+            self.display_results()
+            return
+
+        self.reset_buttons(False, False, True)
+        self.lblResults.setText(self.tr('Searching...'))
+
+        if self.startfrom in self.prefetching:  # wait for the prefetch
+            self.pending_page = self.startfrom
+            return
+
+        self.fetch_page()
 
-        self.display_results()
+    def fetch_page(self):
+        """fetch the page at startfrom in the background"""
+
+        # page against a copy of the current catalogue
+        self.search_tasks.start_streaming(
+            get_page, partial(self._search_progress, self.search_id),
+            partial(self._search_finished, self.search_id, streamed=True),
+            partial(self._search_failed, self.search_id),
+            self.catalog, self.constraints, self.startfrom, self.maxrecords)
 
     def add_to_ows(self):
         """add to OWS provider connection list"""
@@ -628,29 +1203,28 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             stype = ['OGC:WCS', 'wcs', 'wcs']
             data_url = item_data['wcs']
 
-        # test if URL is valid WMS server
-        try:
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        # test if URL is valid OWS server, in the background
+        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        self.tasks.start(probe_ows,
+                         partial(self._ows_found, stype, data_url),
+                         partial(self._ows_failed, stype),
+                         self.ows_cache, stype[0], data_url,
+                         self.settings.value('/MetaSearch/owsProbeTimeout',
+                                             30, int))
 
-            service_type = stype[0]
-            if service_type == 'OGC:WMS/OGC:WMTS':
-                try:
-                    ows = WebMapService(data_url)
-                except Exception, err:
-                    ows = WebMapTileService(data_url)
-            elif service_type == 'OGC:WFS':
-                ows = WebFeatureService(data_url)
-            elif service_type == 'OGC:WCS':
-                # TODO: remove version once OWSLib defaults to 1.0.0
-                ows = WebCoverageService(data_url, '1.0.0')
-        except Exception, err:
-            QApplication.restoreOverrideCursor()
-            msg = self.tr('Error connecting to %s: %s' % (stype[0], err))
-            QMessageBox.warning(self, self.tr('Connection error'), msg)
-            return
+    def _ows_failed(self, stype, err):
+        """report an OWS which cannot be added"""
+
+        QApplication.restoreOverrideCursor()
+        msg = self.tr('Error connecting to %s: %s' % (stype[0], err))
+        QMessageBox.warning(self, self.tr('Connection error'), msg)
+
+    def _ows_found(self, stype, data_url, ows):
+        """store the connection of a valid OWS and open its provider"""
 
         QApplication.restoreOverrideCursor()
 
+        service_type = stype[0]
         if ows.identification.title is not None:
             sname = ows.identification.title
         else:
@@ -724,22 +1298,44 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
             return
 
         identifier = get_item_data(item, 'identifier')
+        url = get_item_data(item, 'source')
 
-        try:
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-            cat = CatalogueServiceWeb(self.catalog_url)
-            cat.getrecordbyid(
-                [self.catalog.records[identifier].identifier])
-        except ExceptionReport, err:
-            QApplication.restoreOverrideCursor()
+        record = self.record_cache.get((url, identifier))
+        if record is not None:
+            self.show_record_metadata(record)
+            return
+
+        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+        self.tasks.start(get_records_by_id,
+                         partial(self._metadata_fetched, url, identifier),
+                         self._metadata_failed,
+                         self.caps_cache, url, [identifier])
+
+    def _metadata_fetched(self, url, identifier, catalog):
+        """cache and show the full record of a metadata request"""
+
+        QApplication.restoreOverrideCursor()
+
+        record = catalog.records.get(identifier)
+        if record is None:
+            self.missing.add((url, identifier))
             QMessageBox.warning(self, self.tr('GetRecords error'),
-                                self.tr('Error getting response: %s' % err))
+                                self.tr('Record %s not found') % identifier)
             return
 
+        self.missing.discard((url, identifier))
+        self.record_cache.put((url, identifier), record)
+        self.show_record_metadata(record)
+
+    def _metadata_failed(self, err):
+        """report a failed metadata request"""
+
         QApplication.restoreOverrideCursor()
+        QMessageBox.warning(self, self.tr('GetRecords error'),
+                            self.tr('Error getting response: %s' % err))
 
-        record = cat.records[identifier]
-        record.xml_url = cat.request
+    def show_record_metadata(self, record):
+        """show the metadata of a full record in a dialogue"""
 
         crd = RecordDialog()
         metadata = render_template('en', self.context,
@@ -753,18 +1349,112 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
     def show_xml(self):
         """show XML request / response"""
 
+        catalog = self.catalog
+        item = self.treeRecords.currentItem()
+        if self.sender().objectName() == 'btnShowXml':
+            if item:  # federated results come from several catalogues
+                catalog = self.catalogs[get_item_data(item, 'source')]
+            elif catalog is None:
+                return
+
         crd = XMLDialog()
-        request_html = highlight_xml(self.context, self.catalog.request)
-        response_html = highlight_xml(self.context, self.catalog.response)
         style = QgsApplication.reportStyleSheet()
-        crd.txtbrXMLRequest.clear()
-        crd.txtbrXMLResponse.clear()
-        crd.txtbrXMLRequest.document().setDefaultStyleSheet(style)
-        crd.txtbrXMLResponse.document().setDefaultStyleSheet(style)
-        crd.txtbrXMLRequest.setHtml(request_html)
-        crd.txtbrXMLResponse.setHtml(response_html)
+        for browser in [crd.txtbrXMLRequest, crd.txtbrXMLResponse]:
+            browser.clear()
+            browser.document().setDefaultStyleSheet(style)
+
+        self.render_xml(crd.txtbrXMLRequest, catalog.request)
+        if catalog.response is None and catalog.request:
+            # search responses are parsed as they arrive, without a copy
+            browser = crd.txtbrXMLResponse
+            browser.setPlainText(self.tr('Loading...'))
+            self.tasks.start(fetch_response,
+                             partial(self._response_fetched, browser),
+                             partial(self._response_failed, browser),
+                             catalog)
+        else:
+            self.render_xml(crd.txtbrXMLResponse, catalog.response)
         crd.exec_()
 
+    def _response_fetched(self, browser, catalog):
+        """show a response fetched for the XML dialogue"""
+
+        if not sip.isdeleted(browser):
+            self.render_xml(browser, catalog.response)
+
+    def _response_failed(self, browser, err):
+        """report a response which could not be fetched"""
+
+        if not sip.isdeleted(browser):
+            browser.setPlainText(self.tr('Error getting response: %s' % err))
+
+    def render_xml(self, browser, xml):
+        """show XML in a text browser, formatting it in the background"""
+
+        if not xml:
+            return
+
+        browser.xml_pending = None  # stop appending an earlier document
+
+        if isinstance(xml, unicode):
+            key = hashlib.md5(xml.encode('utf-8')).hexdigest()
+        else:
+            key = hashlib.md5(xml).hexdigest()
+
+        formatted = self.xml_cache.get(key)
+        if formatted is not None:
+            self._xml_formatted(browser, key, formatted)
+            return
+
+        browser.setPlainText(self.tr('Formatting XML...'))
+        self.tasks.start(format_xml,
+                         partial(self._xml_formatted, browser, key),
+                         partial(self._xml_failed, browser, xml),
+                         self.context, xml, self.xml_limit)
+
+    def _xml_formatted(self, browser, key, formatted):
+        """cache formatted XML and show it if the dialog is still open"""
+
+        self.xml_cache.put(key, formatted)
+
+        if sip.isdeleted(browser):
+            return
+
+        html, text = formatted
+        if html is None:  # too large to highlight
+            browser.setPlainText(text)
+            return
+
+        # a long page set at once blocks the GUI, the rest is appended
+        # block by block between events
+        css, blocks = html
+        pending = browser.xml_pending = iter(blocks[1:])
+        browser.document().setDefaultStyleSheet(css)
+        browser.setHtml(blocks[0])
+        self._append_xml(browser, pending)
+
+    def _append_xml(self, browser, pending):
+        """append the next block of highlighted XML to a text browser"""
+
+        if sip.isdeleted(browser) or browser.xml_pending is not pending:
+            return  # closed or showing another document
+
+        block = next(pending, None)
+        if block is None:
+            return
+
+        cursor = QTextCursor(browser.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertHtml(block)
+        QTimer.singleShot(0, partial(self._append_xml, browser, pending))
+
+    def _xml_failed(self, browser, xml, err):
+        """show the XML as is if it cannot be formatted"""
+
+        LOGGER.debug('Cannot format XML: %s', err)
+        if not sip.isdeleted(browser):
+            browser.setPlainText(xml)
+
     def reset_buttons(self, services=True, xml=True, navigation=True):
         """Convenience function to disable WMS/WMTS|WFS|WCS buttons"""
 
@@ -786,15 +1476,31 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         """back out of dialogue"""
 
         QDialog.reject(self)
+        self.watch_crs(False)
         self.rubber_band.reset()
+        self.footprints.clear()
+
+    def stop_tasks(self):
+        """stop all background work, for unloading the plugin
+
+        A running harvest stops after its current page, the other running
+        tasks are waited for and queued ones dropped.
+        """
+
+        if self.harvest_stop is not None:
+            self.harvest_stop.set()
+        for tasks in [self.search_tasks, self.federated_tasks,
+                      self.prefetch_tasks, self.record_tasks,
+                      self.harvest_tasks, self.tasks]:
+            tasks.wait()
 
     def _get_csw(self):
-        """convenience function to init owslib.csw.CatalogueServiceWeb"""
+        """convenience function to connect to the current catalogue"""
 
         # connect to the server
         try:
             QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-            self.catalog = CatalogueServiceWeb(self.catalog_url)
+            self.catalog = self.caps_cache.connect(self.catalog_url)
             return True
         except ExceptionReport, err:
             msg = self.tr('Error connecting to service: %s' % err)
@@ -808,6 +1514,132 @@ class MetaSearchDialog(QDialog, Ui_MetaSearchDialog):
         return False
 
 
+def get_records(caps_cache, url, constraints, startposition, maxrecords,
+                timeout=10, callback=None):
+    """connect to a CSW and run a GetRecords request (run in a worker)
+
+    callback, if given, receives (catalog, item) for the result summary
+    and each record as soon as it has been parsed.
+    """
+
+    catalog = caps_cache.connect(url, timeout)
+    return get_page(catalog, constraints, startposition, maxrecords,
+                    callback, copy_catalog=False)
+
+
+def harvest_records(caps_cache, url, path, pagesize, stop, remove_deleted,
+                    callback=None):
+    """sync a CSW into the record store at path (run in a worker)
+
+    Returns the number of records stored, changed and removed.
+    """
+
+    store = RecordStore(path)  # SQLite connections are bound to a thread
+    try:
+        catalog = caps_cache.connect(url)
+        count, changed = sync(catalog, store, pagesize, callback, stop)
+        deleted = 0
+        if remove_deleted and not stop.is_set():
+            deleted = reconcile(catalog, store, callback=callback, stop=stop)
+        return count - deleted, changed, deleted
+    finally:
+        store.close()
+
+
+def get_page(catalog, constraints, startposition, maxrecords, callback=None,
+             copy_catalog=True):
+    """run a GetRecords request against a copy of a connected CSW
+
+    The copy shares the parsed capabilities of catalog, so the records
+    currently on display are left untouched while the request runs.
+    """
+
+    if copy_catalog:
+        catalog = copy.copy(catalog)
+
+    def progress(item):
+        """tag each parsed item with the catalogue it belongs to"""
+
+        if callback is not None:
+            callback((catalog, item))
+
+    return getrecords(catalog, constraints, LIST_ESN, startposition,
+                      maxrecords, progress)
+
+
+def get_records_by_id(caps_cache, url, identifiers):
+    """run a GetRecordById request for full records (run in a worker)"""
+
+    catalog = caps_cache.connect(url)
+    with httppool.pooled():
+        catalog.getrecordbyid(identifiers, esn='full')
+
+    # the request URL ends with the comma separated identifiers, point
+    # each record to a request for itself alone
+    base_url = catalog.request[:-len(','.join(identifiers))]
+    for identifier, record in catalog.records.iteritems():
+        record.xml_url = '%s%s' % (base_url, identifier)
+        record_services(record)  # classify links in the worker thread
+    return catalog
+
+
+def probe_ows(ows_cache, service_type, url, timeout):
+    """return an OWSLib client for url (run in a worker)
+
+    All clients of service_type read the capabilities at once and the
+    first to succeed wins.  Capabilities are taken from ows_cache if there,
+    and added to it otherwise.
+    """
+
+    clients = OWS_CLIENTS[service_type]
+
+    for name, client in clients:  # seen before
+        key = '%s %s' % (name, url)
+        xml = ows_cache.get(key)
+        if xml is not None:
+            try:
+                return client(url, xml=xml)
+            except Exception, err:
+                LOGGER.debug('Cached capabilities of %s unusable: %s',
+                             key, err)
+                ows_cache.remove(key)
+
+    answers = Queue.Queue()
+
+    def probe(name, client):
+        """read the capabilities with one client"""
+
+        try:
+            with httppool.pooled():
+                ows = client(url)
+            answers.put((name, ows, None))
+        except Exception, err:
+            answers.put((name, None, err))
+
+    for name, client in clients:
+        thread = threading.Thread(target=probe, args=(name, client))
+        thread.daemon = True  # a server which never answers is left behind
+        thread.start()
+
+    deadline = time.time() + timeout
+    error = None
+    for i in range(len(clients)):
+        try:
+            name, ows, err = answers.get(
+                timeout=max(deadline - time.time(), 0))
+        except Queue.Empty:
+            break
+        if ows is not None:
+            ows_cache.put('%s %s' % (name, url),
+                          etree.tostring(ows._capabilities))
+            return ows
+        error = err
+
+    if error is not None:
+        raise error
+    raise RuntimeError('No response within %d seconds' % timeout)
+
+
 def save_connections():
     """save servers to list"""
 
@@ -835,21 +1667,44 @@ def _get_field_value(field):
         value = 0
     if field == 'link':
         value = 1
+    if field == 'source':
+        value = 2
 
     return value
 
 
-def bbox_to_polygon(bbox):
-    """converts OWSLib bbox object to list of QgsPoint objects"""
+def record_footprints(catalogs):
+    """return the footprints of the records of catalogs, by URL
+
+    Footprints are (url, identifier, title, type, minx, miny, maxx, maxy)
+    tuples, records without a valid bbox are skipped.
+    """
+
+    footprints = []
+    for url, catalog in catalogs.items():
+        for identifier, record in catalog.records.items():
+            if record.bbox is None:
+                continue
+            try:
+                bbox = (float(record.bbox.minx), float(record.bbox.miny),
+                        float(record.bbox.maxx), float(record.bbox.maxy))
+            except (TypeError, ValueError):
+                continue
+            footprints.append((url, identifier, record.title,
+                               record.type) + bbox)
+    return footprints
+
+
+def bbox_to_polygon(bbox, xform=None):
+    """converts OWSLib bbox object to list of QgsPoint objects
+
+    The points are projected with xform, if given ([None] if the bbox
+    cannot be projected).
+    """
 
     minx = float(bbox.minx)
     miny = float(bbox.miny)
     maxx = float(bbox.maxx)
     maxy = float(bbox.maxy)
 
-    return [[
-        QgsPoint(minx, miny),
-        QgsPoint(minx, maxy),
-        QgsPoint(maxx, maxy),
-        QgsPoint(maxx, miny)
-    ]]
+    return project_bboxes([(minx, miny, maxx, maxy)], xform)
@@ -30,10 +30,11 @@
 
 import xml.etree.ElementTree as etree
 
-from PyQt4.QtCore import QSettings
-from PyQt4.QtGui import (QDialog, QDialogButtonBox, QFileDialog,
-                         QListWidgetItem, QMessageBox)
+from PyQt4.QtCore import Qt
+from PyQt4.QtGui import (QDialog, QDialogButtonBox, QFileDialog, QMessageBox,
+                         QSortFilterProxyModel, QStringListModel)
 
+from MetaSearch.connections import ask_policy, get_registry, SKIP
 from MetaSearch.ui.manageconnectionsdialog import Ui_ManageConnectionsDialog
 from MetaSearch.util import get_connections_from_file, prettify_xml
 
@@ -45,9 +46,20 @@ class ManageConnectionsDialog(QDialog, Ui_ManageConnectionsDialog):
 
         QDialog.__init__(self)
         self.setupUi(self)
-        self.settings = QSettings()
+        self.connections = get_registry()
         self.filename = None
+        self.entries = []  # (name, URL) pairs of the file being loaded
         self.mode = mode  # 0 - save, 1 - load
+
+        # the list only creates rows on display, the filter matches anywhere
+        # in the name
+        self.model = QStringListModel(self)
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.listConnections.setModel(self.proxy)
+        self.leFilter.textChanged.connect(self.proxy.setFilterFixedString)
+
         self.btnBrowse.clicked.connect(self.select_file)
         self.manage_gui()
 
@@ -96,24 +108,18 @@ class ManageConnectionsDialog(QDialog, Ui_ManageConnectionsDialog):
         """populate connections list from settings"""
 
         if self.mode == 0:
-            self.settings.beginGroup('/MetaSearch/')
-            keys = self.settings.childGroups()
-            for key in keys:
-                item = QListWidgetItem(self.listConnections)
-                item.setText(key)
-            self.settings.endGroup()
-
-        else:  # populate connections list from file
-            doc = get_connections_from_file(self, self.filename)
-            if doc is None:
+            self.model.setStringList(self.connections.names)
+
+        else:  # populate connections list from file, kept for load()
+            entries = get_connections_from_file(self, self.filename)
+            if entries is None:
                 self.filename = None
                 self.leFileName.clear()
-                self.listConnections.clear()
+                self.clear()
                 return
 
-            for csw in doc.findall('csw'):
-                item = QListWidgetItem(self.listConnections)
-                item.setText(csw.attrib.get('name'))
+            self.entries = entries
+            self.model.setStringList([name for name, url in entries])
 
     def save(self, connections):
         """save connections ops"""
@@ -122,7 +128,7 @@ class ManageConnectionsDialog(QDialog, Ui_ManageConnectionsDialog):
         doc.attrib['version'] = '1.0'
 
         for conn in connections:
-            url = self.settings.value('/MetaSearch/%s/url' % conn)
+            url = self.connections.url(conn)
             if url is not None:
                 connection = etree.SubElement(doc, 'csw')
                 connection.attrib['name'] = conn
@@ -138,42 +144,30 @@ class ManageConnectionsDialog(QDialog, Ui_ManageConnectionsDialog):
     def load(self, items):
         """load connections"""
 
-        self.settings.beginGroup('/MetaSearch/')
-        keys = self.settings.childGroups()
-        self.settings.endGroup()
-
-        exml = etree.parse(self.filename).getroot()
-
-        for csw in exml.findall('csw'):
-            conn_name = csw.attrib.get('name')
+        items = set(items)
+        connections = [(name, url) for name, url in self.entries
+                       if name in items]
 
-            # process only selected connections
-            if conn_name not in items:
-                continue
-
-            # check for duplicates
-            if conn_name in keys:
-                label = self.tr('File %s exists. Overwrite?' % conn_name)
-                res = QMessageBox.warning(self, self.tr('Loading Connections'),
-                                          label,
-                                          QMessageBox.Yes | QMessageBox.No)
-                if res != QMessageBox.Yes:
-                    continue
+        policy = SKIP
+        conflicts = self.connections.conflicts(items)
+        if conflicts:
+            policy = ask_policy(self, self.tr('Loading Connections'),
+                                conflicts)
+            if policy is None:
+                return
 
-            # no dups detected or overwrite is allowed
-            url = '/MetaSearch/%s/url' % conn_name
-            self.settings.setValue(url, csw.attrib.get('url'))
+        self.connections.import_connections(connections, policy)
 
     def accept(self):
         """accept connections"""
 
-        selection = self.listConnections.selectedItems()
+        selection = self.listConnections.selectionModel().selectedIndexes()
         if len(selection) == 0:
             return
 
         items = []
         for sel in selection:
-            items.append(sel.text())
+            items.append(sel.data())
 
         if self.mode == 0:  # save
             self.save(items)
@@ -182,9 +176,16 @@ class ManageConnectionsDialog(QDialog, Ui_ManageConnectionsDialog):
 
         self.filename = None
         self.leFileName.clear()
-        self.listConnections.clear()
+        self.clear()
         self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(False)
 
+    def clear(self):
+        """empty the connections list"""
+
+        self.entries = []
+        self.model.setStringList([])
+        self.leFilter.clear()
+
     def reject(self):
         """back out of manage connections dialogue"""
 
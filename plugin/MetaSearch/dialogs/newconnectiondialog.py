@@ -31,6 +31,7 @@
 from PyQt4.QtCore import QSettings
 from PyQt4.QtGui import QDialog, QMessageBox
 
+from MetaSearch.connections import get_registry
 from MetaSearch.ui.newconnectiondialog import Ui_NewConnectionDialog
 
 
@@ -42,6 +43,7 @@ class NewConnectionDialog(QDialog, Ui_NewConnectionDialog):
         QDialog.__init__(self)
         self.setupUi(self)
         self.settings = QSettings()
+        self.connections = get_registry()
         self.conn_name = None
         self.conn_name_orig = conn_name
 
@@ -57,13 +59,9 @@ class NewConnectionDialog(QDialog, Ui_NewConnectionDialog):
             return
 
         if conn_name is not None:
-            key = '/MetaSearch/%s' % conn_name
-            keyurl = '%s/url' % key
-            key_orig = '/MetaSearch/%s' % self.conn_name_orig
-
             # warn if entry was renamed to an existing connection
             if all([self.conn_name_orig != conn_name,
-                    self.settings.contains(keyurl)]):
+                    conn_name in self.connections]):
                 res = QMessageBox.warning(self, self.tr('Save connection'),
                                           self.tr('Overwrite %s?' % conn_name),
                                           QMessageBox.Ok | QMessageBox.Cancel)
@@ -73,9 +71,9 @@ class NewConnectionDialog(QDialog, Ui_NewConnectionDialog):
             # on rename delete original entry first
             if all([self.conn_name_orig is not None,
                     self.conn_name_orig != conn_name]):
-                self.settings.remove(key_orig)
+                self.connections.remove(self.conn_name_orig)
 
-            self.settings.setValue(keyurl, conn_url)
+            self.connections.set_url(conn_name, conn_url)
             self.settings.setValue('/MetaSearch/selected', conn_name)
 
             QDialog.accept(self)
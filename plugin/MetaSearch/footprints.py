@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""footprints of search results as a temporary vector layer"""
+
+import logging
+
+from PyQt4.QtCore import QVariant
+
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsCsException, QgsFeature, QgsField, QgsFillSymbolV2,
+                       QgsGeometry, QgsMapLayerRegistry, QgsPoint,
+                       QgsVectorLayer)
+
+LOGGER = logging.getLogger('MetaSearch')
+
+LAYER_NAME = 'MetaSearch footprints'
+
+FIELDS = ['identifier', 'title', 'type', 'source']
+
+
+class TransformCache(object):
+    """coordinate transforms between EPSG:4326 and the map canvas CRS
+
+    Transforms are created once per (source, destination) CRS pair and
+    dropped when the canvas CRS changes.
+    """
+
+    def __init__(self, canvas):
+        """init"""
+
+        self.canvas = canvas
+        self.wgs84 = QgsCoordinateReferenceSystem(4326)
+        self._transforms = {}
+
+        canvas.mapRenderer().destinationSrsChanged.connect(self.clear)
+
+    def get(self, src, dst):
+        """return a transform from src to dst, or None if they are equal"""
+
+        if src == dst:
+            return None
+
+        key = (src.authid() or src.toProj4(), dst.authid() or dst.toProj4())
+        xform = self._transforms.get(key)
+        if xform is None:
+            xform = QgsCoordinateTransform(src, dst)
+            self._transforms[key] = xform
+        return xform
+
+    def to_map(self):
+        """return the transform from EPSG:4326 to the canvas CRS"""
+
+        return self.get(self.wgs84, self.canvas.mapRenderer().destinationCrs())
+
+    def from_map(self):
+        """return the transform from the canvas CRS to EPSG:4326"""
+
+        return self.get(self.canvas.mapRenderer().destinationCrs(), self.wgs84)
+
+    def clear(self):
+        """drop all transforms"""
+
+        self._transforms.clear()
+
+
+def project_bboxes(bboxes, xform):
+    """project the corners of many bboxes at once
+
+    bboxes is a list of (minx, miny, maxx, maxy) tuples.  All corners are
+    transformed in a single call, returning a ring of four QgsPoints per
+    bbox (None for a bbox which cannot be projected).
+    """
+
+    points = []
+    for minx, miny, maxx, maxy in bboxes:
+        points.extend([QgsPoint(minx, miny), QgsPoint(minx, maxy),
+                       QgsPoint(maxx, maxy), QgsPoint(maxx, miny)])
+
+    if xform is not None and points:
+        try:
+            geom = QgsGeometry.fromMultiPoint(points)
+            geom.transform(xform)
+            points = geom.asMultiPoint()
+        except QgsCsException:  # find the offending bboxes one by one
+            return [project_bbox(bbox, xform) for bbox in bboxes]
+
+    return [points[i:i + 4] for i in range(0, len(points), 4)]
+
+
+def project_bbox(bbox, xform):
+    """project the corners of a single bbox, or return None"""
+
+    try:
+        return [xform.transform(QgsPoint(x, y)) for x, y in
+                [(bbox[0], bbox[1]), (bbox[0], bbox[3]),
+                 (bbox[2], bbox[3]), (bbox[2], bbox[1])]]
+    except QgsCsException, err:
+        LOGGER.debug('Cannot project bbox %s: %s', bbox, err)
+        return None
+
+
+class FootprintLayer(object):
+    """memory layer holding the footprints of search results
+
+    All footprints are loaded in one batch, in the CRS of the map canvas,
+    and the footprint of the selected record is highlighted by selecting
+    its feature.
+    """
+
+    def __init__(self, canvas, transforms):
+        """init, transforms is a TransformCache"""
+
+        self.canvas = canvas
+        self.transforms = transforms
+        self.layer = None
+        self.features = {}  # feature ids by (catalogue URL, identifier)
+
+        QgsMapLayerRegistry.instance().layerWillBeRemoved.connect(
+            self._layer_removed)
+
+    def show(self, footprints):
+        """replace the footprints on display
+
+        footprints is an iterable of (url, identifier, title, type, minx,
+        miny, maxx, maxy) tuples, with the bbox in EPSG:4326.
+        """
+
+        footprints = list(footprints)
+        rings = project_bboxes([footprint[4:] for footprint in footprints],
+                               self.transforms.to_map())
+
+        keys = []
+        features = []
+        for footprint, ring in zip(footprints, rings):
+            if ring is None:
+                continue
+            url, identifier, title, type_ = footprint[:4]
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry.fromPolygon([ring]))
+            feature.setAttributes([identifier, title, type_, url])
+            keys.append((url, identifier))
+            features.append(feature)
+
+        if not features:  # no empty layer in the project
+            self.clear()
+            self.features = {}
+            return
+
+        layer = self._get_layer(self.canvas.mapRenderer().destinationCrs())
+        provider = layer.dataProvider()
+        provider.deleteFeatures(layer.allFeatureIds())
+
+        result, added = provider.addFeatures(features)
+        self.features = dict(zip(keys, [new.id() for new in added]))
+
+        layer.updateExtents()
+        layer.removeSelection()
+        layer.triggerRepaint()
+
+    def select(self, url, identifier):
+        """highlight the footprint of a record, return False if not shown"""
+
+        if self.layer is None:
+            return False
+
+        fid = self.features.get((url, identifier))
+        if fid is None:
+            self.layer.removeSelection()
+            return False
+
+        self.layer.setSelectedFeatures([fid])
+        return True
+
+    def clear(self):
+        """remove the layer from the map"""
+
+        if self.layer is not None:
+            QgsMapLayerRegistry.instance().removeMapLayer(self.layer.id())
+
+    def _get_layer(self, crs):
+        """return the footprint layer, creating it if needed"""
+
+        if self.layer is not None and self.layer.crs() != crs:
+            self.clear()  # recreated in the new canvas CRS
+
+        if self.layer is None:
+            layer = QgsVectorLayer('Polygon?crs=%s' % crs.authid(),
+                                   LAYER_NAME, 'memory')
+            layer.dataProvider().addAttributes(
+                [QgsField(name, QVariant.String) for name in FIELDS])
+            layer.updateFields()
+            layer.rendererV2().setSymbol(QgsFillSymbolV2.createSimple({
+                'color': '255,0,0,25',
+                'color_border': '255,0,0,150',
+                'width_border': '0.4'
+            }))
+            QgsMapLayerRegistry.instance().addMapLayer(layer)
+            self.layer = layer
+
+        return self.layer
+
+    def _layer_removed(self, layer_id):
+        """forget the layer when it is removed from the map"""
+
+        if self.layer is not None and self.layer.id() == layer_id:
+            self.layer = None
+            self.features = {}
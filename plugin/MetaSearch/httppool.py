@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""persistent (keep-alive) HTTP connections for urllib2
+
+MetaSearch's own requests go through open_url(), which uses an opener
+built around KeepAliveHandler, so that requests to the same host reuse
+idle connections instead of paying a TCP/TLS handshake each.  OWSLib
+requests made inside a pooled() block are routed the same way.  The
+process-wide urllib2 opener, which QGIS and other plugins rely on, is
+left alone.
+"""
+
+from contextlib import contextmanager
+import httplib
+import logging
+import socket
+import sys
+import threading
+import time
+import urllib
+import urllib2
+
+LOGGER = logging.getLogger('MetaSearch')
+
+POOL = None
+OPENER = None
+
+# OWSLib modules calling a urlopen of their own, see pooled()
+OWSLIB_MODULES = ['owslib.csw', 'owslib.util', 'owslib.coverage.wcsBase',
+                  'owslib.feature.wfs100', 'owslib.feature.wfs110',
+                  'owslib.feature.wfs200']
+
+# threads inside a pooled() block
+LOCAL = threading.local()
+
+# the urlopen of each hooked OWSLib module, by module name
+HOOKED = {}
+HOOK_LOCK = threading.Lock()
+
+
+class ConnectionPool(object):
+    """idle persistent HTTP connections, keyed by scheme and host"""
+
+    def __init__(self, maxsize=4, idle_timeout=30):
+        """init, maxsize is the number of idle connections kept per host"""
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """return an idle connection for key, or None"""
+
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                stamp, conn = idle.pop()
+                if now - stamp < self.idle_timeout:
+                    return conn
+                conn.close()
+        return None
+
+    def release(self, key, conn):
+        """hand a connection back for reuse"""
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((time.time(), conn))
+                return
+        conn.close()
+
+    def count(self, reused):
+        """record that a request used a reused or a new connection"""
+
+        with self._lock:
+            if reused:
+                self.reused += 1
+            else:
+                self.opened += 1
+
+    def stats(self):
+        """return connection usage counters"""
+
+        with self._lock:
+            idle = sum(len(conns) for conns in self._idle.values())
+            return {'opened': self.opened, 'reused': self.reused,
+                    'idle': idle}
+
+    def close(self):
+        """close all idle connections"""
+
+        with self._lock:
+            for idle in self._idle.values():
+                for stamp, conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+class PooledResponse(object):
+    """httplib response which returns its connection to the pool once read"""
+
+    def __init__(self, response, pool, key, conn):
+        """init"""
+
+        self.response = response
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+
+    def recv(self, amt):
+        """socket._fileobject interface"""
+
+        data = self.response.read(amt)
+        if not data or self.response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        """release the connection, or drop it if it cannot be reused"""
+
+        if self.conn is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, self.conn)
+        else:
+            self.response.close()
+            self.conn.close()
+        self.conn = None
+
+
+class KeepAliveHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    """urllib2 handler serving http and https from a ConnectionPool"""
+
+    def __init__(self, pool):
+        """init"""
+
+        urllib2.AbstractHTTPHandler.__init__(self)
+        self.pool = pool
+
+    def http_open(self, req):
+        """open an http URL"""
+
+        return self._open(httplib.HTTPConnection, req)
+
+    def https_open(self, req):
+        """open an https URL"""
+
+        return self._open(httplib.HTTPSConnection, req)
+
+    def _open(self, conn_class, req):
+        """send req over a pooled connection"""
+
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        key = (conn_class.__name__, host, req._tunnel_host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items()
+                       if k not in headers)
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        response = None
+        conn = self.pool.acquire(key)
+        if conn is not None:
+            try:
+                response = self._request(conn, req, headers)
+                self.pool.count(True)
+            except (socket.error, httplib.HTTPException):
+                # the server dropped the idle connection, start afresh
+                conn.close()
+
+        if response is None:
+            conn = conn_class(host, timeout=req.timeout)
+            if req._tunnel_host:
+                tunnel_headers = {}
+                if 'Proxy-Authorization' in headers:
+                    tunnel_headers['Proxy-Authorization'] = \
+                        headers.pop('Proxy-Authorization')
+                conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            try:
+                response = self._request(conn, req, headers)
+            except (socket.error, httplib.HTTPException), err:
+                conn.close()
+                raise urllib2.URLError(err)
+            self.pool.count(False)
+
+        pooled = PooledResponse(response, self.pool, key, conn)
+        fileobj = socket._fileobject(pooled, close=True)
+        resp = urllib.addinfourl(fileobj, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+    def _request(self, conn, req, headers):
+        """issue req on conn and return the httplib response"""
+
+        timeout = req.timeout
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        return conn.getresponse(buffering=True)
+
+
+def install(maxsize=4, idle_timeout=30):
+    """create the shared ConnectionPool and the opener using it"""
+
+    global POOL, OPENER
+
+    uninstall()
+    POOL = ConnectionPool(maxsize, idle_timeout)
+    OPENER = urllib2.build_opener(KeepAliveHandler(POOL))
+    LOGGER.debug('HTTP connection pool installed (size %d, idle %ds)',
+                 maxsize, idle_timeout)
+    return POOL
+
+
+def uninstall():
+    """unhook OWSLib and close pooled connections"""
+
+    global POOL, OPENER
+
+    with HOOK_LOCK:
+        for name, original in HOOKED.items():
+            sys.modules[name].urlopen = original
+        HOOKED.clear()
+
+    if POOL is not None:
+        POOL.close()
+        POOL = None
+        OPENER = None
+
+
+def open_url(url, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """urllib2.urlopen over pooled connections, if installed"""
+
+    opener = OPENER
+    if opener is None:
+        return urllib2.urlopen(url, data, timeout)
+    return opener.open(url, data, timeout)
+
+
+def owslib_urlopen(url, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """urlopen of the hooked OWSLib modules
+
+    Only requests from inside a pooled() block use pooled connections,
+    those of other OWSLib users behave as before.
+    """
+
+    if getattr(LOCAL, 'depth', 0):
+        return open_url(url, data, timeout)
+    return urllib2.urlopen(url, data, timeout)
+
+
+@contextmanager
+def pooled():
+    """run the OWSLib requests of the block over pooled connections
+
+    OWSLib binds urlopen into its modules, the loaded ones are pointed to
+    owslib_urlopen on first use.  POST requests sent through
+    owslib.util.http_post are not covered.
+    """
+
+    if OPENER is not None:
+        with HOOK_LOCK:
+            for name in OWSLIB_MODULES:
+                module = sys.modules.get(name)
+                if module is not None and name not in HOOKED:
+                    HOOKED[name] = module.urlopen
+                    module.urlopen = owslib_urlopen
+
+    LOCAL.depth = getattr(LOCAL, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        LOCAL.depth -= 1
+
+
+def stats():
+    """return connection usage counters of the installed pool"""
+
+    if POOL is None:
+        return {'opened': 0, 'reused': 0, 'idle': 0}
+    return POOL.stats()
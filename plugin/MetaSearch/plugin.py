@@ -27,11 +27,13 @@
 import logging
 import os
 
-from PyQt4.QtCore import QCoreApplication, QLocale, QTranslator
+from PyQt4.QtCore import QCoreApplication, QLocale, QSettings, QTranslator
 from PyQt4.QtGui import QAction, QIcon
 
-from MetaSearch.dialogs.maindialog import MetaSearchDialog
-from MetaSearch.util import StaticContext, translate, open_url
+from qgis.core import QgsApplication
+
+from MetaSearch import httppool
+from MetaSearch.util import get_context, translate, open_url
 
 LOGGER = logging.getLogger('MetaSearch')
 
@@ -42,7 +44,8 @@ class MetaSearchPlugin(object):
         """init"""
 
         self.iface = iface
-        self.context = StaticContext()
+        self.context = get_context()
+        self.dialog = None  # created when MetaSearch is first opened
         self.action_run = None
         self.action_help = None
         self.web_menu = '&MetaSearch'
@@ -92,8 +95,17 @@ class MetaSearchPlugin(object):
 
         self.iface.addPluginToWebMenu(self.web_menu, self.action_help)
 
-        # prefab the dialog but not open it yet
-        self.dialog = MetaSearchDialog(self.iface)
+        # share keep-alive connections across MetaSearch's OWS requests
+        settings = QSettings()
+        httppool.install(
+            settings.value('/MetaSearch/httpPoolSize', 4, int),
+            settings.value('/MetaSearch/httpIdleTimeout', 30, int))
+
+        # keep compiled metadata templates across sessions
+        if settings.value('/MetaSearch/templateBytecodeCache', True, bool):
+            self.context.set_bytecode_cache(os.path.join(
+                QgsApplication.qgisSettingsDirPath(), 'MetaSearch',
+                'templates'))
 
     def unload(self):
         """teardown"""
@@ -104,9 +116,21 @@ class MetaSearchPlugin(object):
         self.iface.removeToolBarIcon(self.action_run)
         self.iface.removeToolBarIcon(self.action_help)
 
+        # QThreads destroyed while running abort QGIS
+        if self.dialog is not None:
+            self.dialog.stop_tasks()
+            self.dialog = None
+
+        httppool.uninstall()
+
     def run(self):
         """open MetaSearch"""
 
+        if self.dialog is None:
+            # the dialog pulls in OWSLib, keep it out of QGIS startup
+            from MetaSearch.dialogs.maindialog import MetaSearchDialog
+            self.dialog = MetaSearchDialog(self.iface)
+
         self.dialog.exec_()
 
     def help(self):
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""streaming XML pretty printer
+
+Produces the same output as xml.dom.minidom's toprettyxml() straight from
+the expat events, without building a DOM.  Only the open elements and the
+text of the current node are held in memory.
+"""
+
+from io import StringIO
+from xml.dom.minidom import parseString
+from xml.parsers import expat
+
+# bytes fed to the parser at a time
+CHUNK_SIZE = 64 * 1024
+
+# element states
+EMPTY, TEXT, BLOCK = range(3)
+
+
+class DoctypeFound(Exception):
+    """document type declarations are left to minidom"""
+    pass
+
+
+def escape(data):
+    """escape character data the way minidom does"""
+
+    if '&' in data:
+        data = data.replace('&', '&amp;')
+    if '<' in data:
+        data = data.replace('<', '&lt;')
+    if '"' in data:
+        data = data.replace('"', '&quot;')
+    if '>' in data:
+        data = data.replace('>', '&gt;')
+    return data
+
+
+def qname(name):
+    """return the qualified name of an expat 'uri local prefix' name"""
+
+    parts = name.split(' ')
+    if len(parts) == 3:
+        return '%s:%s' % (parts[2], parts[1])
+    return parts[-1]
+
+
+class PrettyPrinter(object):
+    """expat handlers writing an indented copy of a document
+
+    Every open element is in one of three states: EMPTY (start tag written
+    without its closing '>'), TEXT (a single text child so far, kept in
+    self.text) or BLOCK (children written on lines of their own).
+    """
+
+    def __init__(self, write, indent='\t', newl='\n'):
+        """init, write is called with each piece of output"""
+
+        self.write = write
+        self.indent = indent
+        self.newl = newl
+        self.stack = []  # [qname, state] of the open elements
+        self.text = []  # pending text node
+        self.cdata = None  # pending CDATA section
+        self.namespaces = []  # xmlns attributes of the next element
+
+        self.parser = expat.ParserCreate(namespace_separator=' ')
+        self.parser.namespace_prefixes = True
+        self.parser.buffer_text = True
+        self.parser.ordered_attributes = True
+        self.parser.specified_attributes = True
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.StartNamespaceDeclHandler = self.start_namespace
+        self.parser.CharacterDataHandler = self.characters
+        self.parser.StartCdataSectionHandler = self.start_cdata
+        self.parser.EndCdataSectionHandler = self.end_cdata
+        self.parser.CommentHandler = self.comment
+        self.parser.ProcessingInstructionHandler = self.processing_instruction
+        self.parser.StartDoctypeDeclHandler = self.doctype
+        self.parser.ExternalEntityRefHandler = lambda *args: 1
+
+        self.write(u'<?xml version="1.0" ?>' + newl)
+
+    def feed(self, data, final=False):
+        """parse a chunk of the document"""
+
+        self.parser.Parse(data, final)
+
+    def child(self):
+        """prepare the current element for a child other than text"""
+
+        self.flush_text()
+        if self.stack and self.stack[-1][1] == EMPTY:
+            self.write(u'>' + self.newl)
+            self.stack[-1][1] = BLOCK
+
+    def flush_text(self):
+        """write the pending text node of a BLOCK element"""
+
+        if self.text and self.stack[-1][1] != EMPTY:
+            if self.stack[-1][1] == TEXT:
+                self.write(u'>' + self.newl)
+                self.stack[-1][1] = BLOCK
+            self.write(escape(u'%s%s%s' % (self.indent * len(self.stack),
+                                           u''.join(self.text), self.newl)))
+            self.text = []
+
+    def start_namespace(self, prefix, uri):
+        """remember a namespace declaration as an attribute"""
+
+        if prefix:
+            self.namespaces.append((u'xmlns:%s' % prefix, uri))
+        else:
+            self.namespaces.append((u'xmlns', uri or u''))
+
+    def start_element(self, name, attrs):
+        """write the start tag, leaving it open"""
+
+        self.child()
+        attributes = self.namespaces
+        self.namespaces = []
+        for i in range(0, len(attrs), 2):
+            attributes.append((qname(attrs[i]), attrs[i + 1]))
+        attributes.sort()
+
+        tag = qname(name)
+        self.write(u'%s<%s' % (self.indent * len(self.stack), tag))
+        for key, value in attributes:
+            self.write(u' %s="%s"' % (key, escape(value)))
+        self.stack.append([tag, EMPTY])
+
+    def end_element(self, name):
+        """close the current element"""
+
+        tag, state = self.stack[-1]
+        if state == EMPTY:
+            self.stack.pop()
+            self.write(u'/>' + self.newl)
+        elif state == TEXT:
+            self.stack.pop()
+            self.write(u'>%s</%s>%s' % (escape(u''.join(self.text)), tag,
+                                        self.newl))
+            self.text = []
+        else:
+            self.flush_text()
+            self.stack.pop()
+            self.write(u'%s</%s>%s' % (self.indent * len(self.stack), tag,
+                                       self.newl))
+
+    def characters(self, data):
+        """collect text, adjacent text is a single node"""
+
+        if self.cdata is not None:
+            self.cdata.append(data)
+            return
+
+        if not self.stack:  # outside the root element
+            return
+        if self.stack[-1][1] == EMPTY:
+            self.stack[-1][1] = TEXT
+        self.text.append(data)
+
+    def start_cdata(self):
+        """begin collecting a CDATA section"""
+
+        self.cdata = []
+
+    def end_cdata(self):
+        """write a CDATA section, which minidom does not indent"""
+
+        data = u''.join(self.cdata)
+        self.cdata = None
+        if not self.stack:
+            return
+        if not data:  # minidom only creates the node for character data
+            return
+        if ']]>' in data:
+            raise ValueError("']]>' not allowed in a CDATA section")
+        self.child()
+        self.write(u'<![CDATA[%s]]>' % data)
+
+    def comment(self, data):
+        """write a comment"""
+
+        if '--' in data:
+            raise ValueError("'--' is not allowed in a comment node")
+        self.child()
+        self.write(u'%s<!--%s-->%s' % (self.indent * len(self.stack), data,
+                                       self.newl))
+
+    def processing_instruction(self, target, data):
+        """write a processing instruction"""
+
+        self.child()
+        self.write(u'%s<?%s %s?>%s' % (self.indent * len(self.stack), target,
+                                       data, self.newl))
+
+    def doctype(self, *args):
+        """stop, see DoctypeFound"""
+
+        raise DoctypeFound()
+
+
+def write_pretty_xml(source, write, indent='\t', newl='\n'):
+    """pretty print the XML string or file object source to write"""
+
+    printer = PrettyPrinter(write, indent, newl)
+    if hasattr(source, 'read'):
+        while True:
+            data = source.read(CHUNK_SIZE)
+            if not data:
+                break
+            printer.feed(data)
+    else:
+        for i in range(0, len(source), CHUNK_SIZE):
+            printer.feed(source[i:i + CHUNK_SIZE])
+    printer.feed('', True)
+
+
+def pretty_xml(xml, indent='\t', newl='\n'):
+    """return xml pretty printed, like minidom's toprettyxml()"""
+
+    output = StringIO()
+    try:
+        write_pretty_xml(xml, output.write, indent, newl)
+    except DoctypeFound:
+        return parseString(xml).toprettyxml(indent, newl)
+    return output.getvalue()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""classification of record links into services which QGIS can add"""
+
+# service types by upper case link protocol, see register_protocols()
+PROTOCOLS = {}
+
+
+def register_protocols(service_type, protocols):
+    """classify links with any of protocols as service_type
+
+    Protocols are matched case-insensitively against the scheme or protocol
+    of a link.  A protocol registered again moves to the new service type.
+    """
+
+    for protocol in protocols:
+        PROTOCOLS[protocol.upper()] = service_type
+
+
+register_protocols('wms', [
+    'OGC:WMS',
+    'OGC:WMS-1.1.1-HTTP-GET-MAP',
+    'OGC:WMS-1.1.1-HTTP-GET-CAPABILITIES',
+    'OGC:WMS-1.3.0-HTTP-GET-MAP',
+    'OGC:WMS-1.3.0-HTTP-GET-CAPABILITIES',
+    # WMTS is added through the WMS provider
+    'OGC:WMTS',
+    'OGC:WMTS-1.0.0-HTTP-GET-CAPABILITIES',
+    'OGC:WMTS-1.0.0-HTTP-GET-TILE'
+])
+
+register_protocols('wfs', [
+    'OGC:WFS',
+    'OGC:WFS-1.0.0-HTTP-GET-CAPABILITIES',
+    'OGC:WFS-1.1.0-HTTP-GET-CAPABILITIES'
+])
+
+register_protocols('wcs', [
+    'OGC:WCS',
+    'OGC:WCS-1.1.0-HTTP-GET-CAPABILITIES'
+])
+
+
+def classify_links(links):
+    """return the service URLs of links by service type
+
+    links are OWSLib link dicts with a 'scheme' or 'protocol' and a 'url',
+    the last link of a service type wins.
+    """
+
+    services = {}
+    for link in links:
+        link_type = link.get('scheme') or link.get('protocol')
+        if link_type is None:
+            continue
+        service_type = PROTOCOLS.get(link_type.upper())
+        if service_type is not None:
+            services[service_type] = link['url']
+    return services
+
+
+def record_services(record):
+    """return the services of a CswRecord, classifying its links once
+
+    The result is kept on the record as record.services.
+    """
+
+    services = getattr(record, 'services', None)
+    if services is None:
+        services = classify_links(record.uris + record.references)
+        record.services = services
+    return services
@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""local SQLite store of harvested catalogue records
+
+A harvest pages through all records of a catalogue, parsing each page
+incrementally and committing it together with the position of the next
+page, so an interrupted harvest resumes where it stopped.  Once a catalogue
+has been harvested, a sync only requests the records modified since the
+previous one, and a reconcile removes records deleted from the catalogue.
+
+Stored records are indexed for offline searching: an FTS4 table over the
+text of each record stands in for csw:AnyText, and an R-tree over the
+bounding boxes stands in for the BBOX filter.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from urllib import urlencode
+
+from owslib.csw import CswRecord, namespaces, outputformat
+from owslib.etree import etree
+from owslib.fes import PropertyIsGreaterThanOrEqualTo
+
+from MetaSearch.streaming import iter_records
+
+LOGGER = logging.getLogger('MetaSearch')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    url TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    type TEXT,
+    title TEXT,
+    abstract TEXT,
+    modified TEXT,
+    minx REAL,
+    miny REAL,
+    maxx REAL,
+    maxy REAL,
+    links TEXT,
+    xml TEXT,
+    PRIMARY KEY (url, identifier)
+);
+CREATE TABLE IF NOT EXISTS harvests (
+    url TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    matches INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    url TEXT PRIMARY KEY,
+    started TEXT NOT NULL,
+    synced TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts4 (
+    title,
+    abstract,
+    anytext
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS records_bbox USING rtree (
+    id,
+    minx, maxx,
+    miny, maxy
+);
+'''
+
+# bumped whenever existing databases need their indexes rebuilt
+SCHEMA_VERSION = 1
+
+
+class LocalCatalogue(object):
+    """results of an offline search, shaped like a CatalogueServiceWeb"""
+
+    def __init__(self, url):
+        """init"""
+
+        self.url = url
+        self.results = {}
+        self.records = OrderedDict()
+        self.request = None
+        self.response = None
+
+
+class RecordStore(object):
+    """SQLite database of harvested records, keyed by catalogue URL"""
+
+    def __init__(self, path):
+        """init, creating the database at path if needed"""
+
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self.reindex()
+            self.conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            self.commit()
+
+    def put_records(self, url, records):
+        """insert or replace records (CswRecord instances) of url"""
+
+        for record in records:
+            if record.identifier:
+                self._delete(url, record.identifier)
+                self._insert([url] + record_row(record))
+
+    def delete_records(self, url, identifiers):
+        """remove the records of url with the given identifiers"""
+
+        for identifier in identifiers:
+            self._delete(url, identifier)
+
+    def identifiers(self, url):
+        """return the identifiers of all records stored for url"""
+
+        return [row[0] for row in self.conn.execute(
+            'SELECT identifier FROM records WHERE url = ?', (url,))]
+
+    def _insert(self, row):
+        """insert a records row and index it"""
+
+        rowid = self.conn.execute(
+            'INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            row).lastrowid
+        self._index(rowid, row)
+
+    def _index(self, rowid, row):
+        """add a records row to the text and spatial indexes"""
+
+        self.conn.execute(
+            'INSERT INTO records_fts (docid, title, abstract, anytext) '
+            'VALUES (?, ?, ?, ?)', (rowid, row[3], row[4], any_text(row[11])))
+        if None not in row[6:10]:
+            self.conn.execute('INSERT INTO records_bbox VALUES '
+                              '(?, ?, ?, ?, ?)',
+                              (rowid, row[6], row[8], row[7], row[9]))
+
+    def _delete(self, url, identifier):
+        """remove a record and its index entries, if stored"""
+
+        row = self.conn.execute(
+            'SELECT rowid FROM records WHERE url = ? AND identifier = ?',
+            (url, identifier)).fetchone()
+        if row is not None:
+            self.conn.execute('DELETE FROM records_fts WHERE docid = ?', row)
+            self.conn.execute('DELETE FROM records_bbox WHERE id = ?', row)
+            self.conn.execute('DELETE FROM records WHERE rowid = ?', row)
+
+    def reindex(self):
+        """rebuild the text and spatial indexes from the stored records"""
+
+        LOGGER.debug('Rebuilding record store indexes: %s', self.path)
+        self.conn.execute('DELETE FROM records_fts')
+        self.conn.execute('DELETE FROM records_bbox')
+        rows = self.conn.execute('SELECT rowid, * FROM records')
+        for row in rows.fetchall():
+            self._index(row[0], row[1:])
+
+    def search(self, url, keywords=None, bbox=None, startposition=0,
+               maxrecords=10):
+        """search the stored records of url
+
+        keywords are matched against the full text of the records, bbox is
+        [minx, miny, maxx, maxy] in EPSG:4326.  Returns a LocalCatalogue
+        holding the page of records starting at startposition (0 based).
+        """
+
+        query, params = self._query(url, keywords, bbox)
+
+        catalog = LocalCatalogue(url)
+        matches = self.conn.execute('SELECT COUNT(*) %s' % query,
+                                    params).fetchone()[0]
+        rows = self.conn.execute(
+            'SELECT identifier, xml %s ORDER BY rowid LIMIT ? OFFSET ?' %
+            query,
+            params + [maxrecords, startposition]).fetchall()
+
+        for identifier, xml in rows:
+            catalog.records[identifier] = stored_record(url, identifier, xml)
+
+        nextrecord = startposition + len(rows) + 1
+        if nextrecord > matches:
+            nextrecord = 0
+        catalog.results = {'matches': matches, 'returned': len(rows),
+                           'nextrecord': nextrecord}
+        return catalog
+
+    def count(self, url):
+        """number of records stored for url"""
+
+        return self.conn.execute('SELECT COUNT(*) FROM records WHERE url = ?',
+                                 (url,)).fetchone()[0]
+
+    def harvest_state(self, url):
+        """return the harvest state of url as a dict, or None"""
+
+        row = self.conn.execute(
+            'SELECT position, matches, complete, updated FROM harvests '
+            'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return {'position': row[0], 'matches': row[1],
+                'complete': bool(row[2]), 'updated': row[3]}
+
+    def set_harvest_state(self, url, position, matches, complete):
+        """record how far the harvest of url got"""
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO harvests VALUES (?, ?, ?, ?, ?)',
+            (url, position, matches, int(complete), time.time()))
+
+    def begin_sync(self, url, started):
+        """note the start of a harvest or sync of url
+
+        started is the time the catalogue reported for its first response,
+        '' if it reported none.  The client clock is never used, as it
+        need not agree with the dct:modified dates of the catalogue.
+        """
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO syncs VALUES (?, ?, '
+            '(SELECT synced FROM syncs WHERE url = ?))',
+            (url, started or '', url))
+
+    def end_sync(self, url):
+        """mark the last started harvest or sync of url as completed
+
+        Later syncs request the records modified since its start, or since
+        the newest modification date stored if the start is unknown.
+        """
+
+        row = self.conn.execute('SELECT started FROM syncs WHERE url = ?',
+                                (url,)).fetchone()
+        synced = row and row[0]
+        if not synced:
+            synced = self.conn.execute(
+                'SELECT MAX(modified) FROM records WHERE url = ?',
+                (url,)).fetchone()[0]
+        self.conn.execute('UPDATE syncs SET synced = ? WHERE url = ?',
+                          (synced, url))
+
+    def last_sync(self, url):
+        """return the start time of the last completed sync of url, or None"""
+
+        row = self.conn.execute('SELECT synced FROM syncs WHERE url = ?',
+                                (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def footprints(self, url, keywords=None, bbox=None):
+        """return identifier, title, type and bbox of matching records
+
+        Only records with a bbox are returned, as (identifier, title, type,
+        minx, miny, maxx, maxy) rows.
+        """
+
+        query, params = self._query(url, keywords, bbox)
+        return self.conn.execute(
+            'SELECT identifier, title, type, minx, miny, maxx, maxy %s AND '
+            'minx IS NOT NULL ORDER BY rowid' % query, params).fetchall()
+
+    def _query(self, url, keywords, bbox):
+        """return the FROM and WHERE clauses of a search, and its params"""
+
+        # the text and spatial indexes drive the lookups, records are only
+        # read by rowid ('+' keeps SQLite from scanning the url index)
+        match = fts_query(keywords or '')  # '' if there is nothing to match
+        where = ['+url = ?']
+        if not match and bbox is None:
+            where = ['url = ?']
+        params = [url]
+
+        if match:
+            where.append('rowid IN (SELECT docid FROM records_fts '
+                         'WHERE records_fts MATCH ?)')
+            params.append(match)
+        if bbox is not None:
+            where.append('rowid IN (SELECT id FROM records_bbox '
+                         'WHERE maxx >= ? AND minx <= ? AND maxy >= ? '
+                         'AND miny <= ?)')
+            params.extend([float(bbox[0]), float(bbox[2]), float(bbox[1]),
+                           float(bbox[3])])
+
+        return 'FROM records WHERE %s' % ' AND '.join(where), params
+
+    def clear(self, url):
+        """remove all records and the harvest state of url"""
+
+        self.conn.execute('DELETE FROM records_fts WHERE docid IN '
+                          '(SELECT rowid FROM records WHERE url = ?)', (url,))
+        self.conn.execute('DELETE FROM records_bbox WHERE id IN '
+                          '(SELECT rowid FROM records WHERE url = ?)', (url,))
+        self.conn.execute('DELETE FROM records WHERE url = ?', (url,))
+        self.conn.execute('DELETE FROM harvests WHERE url = ?', (url,))
+        self.conn.execute('DELETE FROM syncs WHERE url = ?', (url,))
+
+    def commit(self):
+        """commit pending changes"""
+
+        self.conn.commit()
+
+    def close(self):
+        """close the database"""
+
+        self.conn.close()
+
+
+def record_row(record):
+    """return the column values of a CswRecord, without the URL"""
+
+    bbox = [None, None, None, None]
+    if record.bbox is not None:
+        try:
+            bbox = [float(record.bbox.minx), float(record.bbox.miny),
+                    float(record.bbox.maxx), float(record.bbox.maxy)]
+        except (TypeError, ValueError):
+            pass
+
+    links = json.dumps({'uris': record.uris,
+                        'references': record.references})
+
+    return [record.identifier, record.type, record.title, record.abstract,
+            record.modified] + bbox + [links, record.xml]
+
+
+def any_text(xml):
+    """return all text content of a record, as csw:AnyText does"""
+
+    if not xml:
+        return ''
+    try:
+        text = etree.fromstring(xml.encode('utf-8')).itertext()
+    except Exception, err:  # keep the record searchable by title/abstract
+        LOGGER.debug('Cannot index record text: %s', err)
+        return ''
+    return ' '.join(value.strip() for value in text if value.strip())
+
+
+def fts_query(keywords):
+    """turn free text into an FTS query matching all words as prefixes
+
+    Words without letters or digits are dropped, as the FTS tokenizer does,
+    so the query is '' if keywords holds nothing to match.
+    """
+
+    words = []
+    for word in keywords.split():
+        word = word.replace('"', '').replace('*', '').replace('%', '')
+        if re.search(r'\w', word, re.UNICODE):
+            words.append('"%s*"' % word)
+    return ' '.join(words)
+
+
+def stored_record(url, identifier, xml):
+    """return a CswRecord rebuilt from its stored XML"""
+
+    record = CswRecord(etree.fromstring(xml.encode('utf-8')))
+    record.xml_url = '%s?%s' % (url, urlencode({
+        'service': 'CSW',
+        'version': '2.0.2',
+        'request': 'GetRecordById',
+        'outputFormat': outputformat,
+        'outputSchema': namespaces['csw'],
+        'elementsetname': 'full',
+        'id': identifier
+    }))
+    return record
+
+
+def iter_pages(catalog, constraints=[], esn='full', position=1,
+               pagesize=50, stop=None):
+    """page through a GetRecords result set
+
+    Yields (results, records, next position, complete) for every page, until
+    the last page or until the optional threading.Event stop is set.
+    """
+
+    while stop is None or not stop.is_set():
+        results = {}
+        records = []
+        for item in iter_records(catalog, constraints, esn, position,
+                                 pagesize):
+            if isinstance(item, dict):
+                results = item
+            else:
+                records.append(item)
+
+        matches = results.get('matches', 0)
+        returned = results.get('returned', 0)
+        nextrecord = results.get('nextrecord')
+        if nextrecord is None or 0 < nextrecord <= position:
+            nextrecord = position + returned  # missing or bogus nextRecord
+        complete = returned == 0 or nextrecord == 0 or nextrecord > matches
+
+        yield results, records, nextrecord, complete
+
+        if complete:
+            break
+        position = nextrecord
+
+
+def harvest(catalog, store, pagesize=50, resume=True, callback=None,
+            stop=None):
+    """copy all records of catalog into store
+
+    Pages are parsed incrementally and committed one at a time, so memory
+    is bounded to a page.  With resume, an unfinished harvest continues
+    from the last committed page.  callback, if given, is called with a
+    dict of position, matches and harvested after every page; stop is an
+    optional threading.Event which ends the harvest after the current page.
+
+    Returns the number of records stored for the catalogue.
+    """
+
+    state = store.harvest_state(catalog.url)
+    begin = True
+    if resume and state is not None and not state['complete']:
+        position = state['position']
+        begin = False  # the sync began with the first page
+        LOGGER.debug('Resuming harvest of %s at %d', catalog.url, position)
+    else:
+        position = 1
+        store.clear(catalog.url)
+        store.commit()
+
+    for results, records, position, complete in iter_pages(
+            catalog, [], 'full', position, pagesize, stop):
+        if begin:
+            store.begin_sync(catalog.url, results.get('timestamp'))
+            begin = False
+        store.put_records(catalog.url, records)
+        store.set_harvest_state(catalog.url, position,
+                                results.get('matches', 0), complete)
+        if complete:
+            store.end_sync(catalog.url)
+        store.commit()
+
+        if callback is not None:
+            callback({'position': position,
+                      'matches': results.get('matches', 0),
+                      'harvested': store.count(catalog.url)})
+
+    return store.count(catalog.url)
+
+
+def sync(catalog, store, pagesize=50, callback=None, stop=None):
+    """bring the stored records of catalog up to date
+
+    The first sync harvests the whole catalogue (resuming an unfinished
+    harvest).  Later ones only request the records modified since the start
+    of the previous completed sync, by the catalogue's clock (see
+    RecordStore.end_sync()), using a PropertyIsGreaterThanOrEqualTo
+    constraint on dct:modified, and replace them in the store.  callback
+    and stop are as for harvest().
+
+    Returns the number of records stored and the number of records changed.
+    """
+
+    synced = store.last_sync(catalog.url)
+    if synced is None:
+        count = harvest(catalog, store, pagesize, True, callback, stop)
+        return count, count
+
+    LOGGER.debug('Syncing %s, records modified since %s', catalog.url,
+                 synced)
+    changed = 0
+    begin = True
+    constraints = [PropertyIsGreaterThanOrEqualTo('dct:modified', synced)]
+    for results, records, position, complete in iter_pages(
+            catalog, constraints, 'full', 1, pagesize, stop):
+        if begin:
+            store.begin_sync(catalog.url, results.get('timestamp'))
+            begin = False
+        store.put_records(catalog.url, records)
+        changed += len(records)
+        if complete:
+            store.end_sync(catalog.url)
+        store.commit()
+
+        if callback is not None:
+            callback({'position': position,
+                      'matches': results.get('matches', 0),
+                      'harvested': changed})
+
+    return store.count(catalog.url), changed
+
+
+def reconcile(catalog, store, pagesize=500, callback=None, stop=None):
+    """remove stored records of catalog which the catalogue no longer has
+
+    Lists the identifiers of all records in the catalogue (as brief records)
+    and deletes the stored records missing from the list.  Nothing is
+    deleted unless the listing completed and accounted for every record
+    the catalogue reported.  callback and stop are as for harvest().
+
+    Returns the number of records removed.
+    """
+
+    identifiers = set()
+    listed = False
+    for results, records, position, complete in iter_pages(
+            catalog, [], 'brief', 1, pagesize, stop):
+        identifiers.update(record.identifier for record in records)
+        listed = complete and len(identifiers) == results.get('matches')
+
+        if callback is not None:
+            callback({'position': position,
+                      'matches': results.get('matches', 0),
+                      'harvested': len(identifiers)})
+
+    if not listed:
+        LOGGER.debug('Incomplete identifier listing of %s, not removing '
+                     'records', catalog.url)
+        return 0
+
+    deleted = [identifier for identifier in store.identifiers(catalog.url)
+               if identifier not in identifiers]
+    store.delete_records(catalog.url, deleted)
+    store.commit()
+    LOGGER.debug('Removed %d deleted records of %s', len(deleted),
+                 catalog.url)
+    return len(deleted)
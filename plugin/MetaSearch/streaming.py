@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+"""incremental GetRecords processing
+
+CatalogueServiceWeb.getrecords2 downloads the whole response and builds a
+DOM before the first record can be used.  The functions below send the
+same request but parse the response as it arrives, handing out one
+csw:Record at a time and discarding it from the tree afterwards.
+"""
+
+from collections import OrderedDict
+import random
+import urllib2
+
+from owslib import fes, ows, util
+from owslib.csw import (CswRecord, namespaces, outputformat,
+                        schema_location)
+from owslib.etree import etree
+
+from MetaSearch import httppool
+
+ESN_ELEMENTS = {
+    'brief': 'csw:BriefRecord',
+    'summary': 'csw:SummaryRecord',
+    'full': 'csw:Record'
+}
+
+
+class ResponseRecorder(object):
+    """file-like wrapper keeping a copy of everything read through it"""
+
+    def __init__(self, fileobj):
+        """init"""
+
+        self.fileobj = fileobj
+        self.chunks = []
+
+    def read(self, size=-1):
+        """read from the wrapped file object"""
+
+        data = self.fileobj.read(size)
+        self.chunks.append(data)
+        return data
+
+    def getvalue(self):
+        """return everything read so far"""
+
+        return ''.join(self.chunks)
+
+
+def getrecords_request(catalog, constraints=[], esn='summary',
+                       startposition=0, maxrecords=10,
+                       typenames='csw:Record'):
+    """build a GetRecords request document as getrecords2 does"""
+
+    if etree.__name__ == 'lxml.etree':  # apply nsmap
+        node0 = etree.Element(util.nspath_eval('csw:GetRecords', namespaces),
+                              nsmap=namespaces)
+    else:
+        node0 = etree.Element(util.nspath_eval('csw:GetRecords', namespaces))
+        node0.set('xmlns:ows', namespaces['ows'])
+        node0.set('xmlns:gmd', namespaces['gmd'])
+        node0.set('xmlns:dif', namespaces['dif'])
+        node0.set('xmlns:fgdc', namespaces['fgdc'])
+    node0.set('outputSchema', namespaces['csw'])
+    node0.set('outputFormat', outputformat)
+    node0.set('version', catalog.version)
+    node0.set('service', catalog.service)
+    node0.set('resultType', 'results')
+    if startposition > 0:
+        node0.set('startPosition', str(startposition))
+    node0.set('maxRecords', str(maxrecords))
+    node0.set(util.nspath_eval('xsi:schemaLocation', namespaces),
+              schema_location)
+
+    node1 = etree.SubElement(node0, util.nspath_eval('csw:Query', namespaces))
+    node1.set('typeNames', typenames)
+
+    etree.SubElement(node1, util.nspath_eval('csw:ElementSetName',
+                                             namespaces)).text = esn
+
+    if len(constraints) > 0:
+        node2 = etree.SubElement(node1, util.nspath_eval('csw:Constraint',
+                                                         namespaces))
+        node2.set('version', '1.1.0')
+        node2.append(fes.FilterRequest().setConstraintList(constraints))
+
+    node0 = util.cleanup_namespaces(node0)
+    return util.xml2string(etree.tostring(node0))
+
+
+def iter_records(catalog, constraints=[], esn='summary', startposition=0,
+                 maxrecords=10, keep_response=False):
+    """run a GetRecords request, parsing the response as it arrives
+
+    Yields the search results summary (a dict like catalog.results, plus
+    the csw:SearchStatus timestamp of the server or None) first, followed
+    by a CswRecord for each record in the response.  The request
+    is stored in catalog.request.  With keep_response the raw response is
+    stored in catalog.response once the generator is exhausted, otherwise
+    catalog.response is None and the response is never held in memory.
+    """
+
+    catalog.request = getrecords_request(catalog, constraints, esn,
+                                         startposition, maxrecords)
+    catalog.response = None
+
+    response = post_request(catalog)
+
+    source = response
+    if keep_response:
+        source = ResponseRecorder(response)
+
+    record_tag = util.nspath_eval(ESN_ELEMENTS[esn], namespaces)
+    results_tag = util.nspath_eval('csw:SearchResults', namespaces)
+    status_tag = util.nspath_eval('csw:SearchStatus', namespaces)
+    valid_tags = [
+        util.nspath_eval('csw:GetRecordsResponse', namespaces),
+        util.nspath_eval('ows:ExceptionReport', namespaces)
+    ]
+
+    root = None
+    container = None
+    timestamp = None
+
+    try:
+        for event, elem in etree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                    if root.tag not in valid_tags:
+                        raise RuntimeError('Document is XML, but not '
+                                           'CSW-ish')
+                elif elem.tag == status_tag:
+                    timestamp = elem.get('timestamp')
+                elif elem.tag == results_tag:
+                    container = elem
+                    results = search_results(elem)
+                    results['timestamp'] = timestamp
+                    yield results
+            elif elem.tag == record_tag and container is not None:
+                yield CswRecord(elem)
+                # keep memory bounded to the record being parsed
+                try:
+                    container.remove(elem)
+                except ValueError:
+                    pass
+            elif elem is root and root.tag == valid_tags[1]:
+                raise ows.ExceptionReport(etree.ElementTree(root),
+                                          catalog.owscommon.namespace)
+    finally:
+        response.close()
+
+    if keep_response:
+        catalog.response = source.getvalue()
+
+
+def post_request(catalog):
+    """send catalog.request and return the open response"""
+
+    req = urllib2.Request(catalog.url, catalog.request)
+    req.add_header('Content-type', 'text/xml')
+    req.add_header('Accept', 'text/xml')
+    req.add_header('Accept-Language', catalog.lang)
+    return httppool.open_url(req, timeout=catalog.timeout)
+
+
+def fetch_response(catalog):
+    """send catalog.request again, keeping the raw response
+
+    For showing the response of a request which was streamed without
+    keeping it.  Returns catalog.
+    """
+
+    response = post_request(catalog)
+    try:
+        catalog.response = response.read()
+    finally:
+        response.close()
+    return catalog
+
+
+def search_results(elem):
+    """return the result summary of a csw:SearchResults element"""
+
+    results = {'matches': 0, 'returned': 0, 'nextrecord': None}
+
+    for key, attrib in [('matches', 'numberOfRecordsMatched'),
+                        ('returned', 'numberOfRecordsReturned'),
+                        ('nextrecord', 'nextRecord')]:
+        val = elem.attrib.get(attrib)
+        if val is not None:
+            results[key] = int(util.testXMLValue(val, True))
+
+    return results
+
+
+def getrecords(catalog, constraints=[], esn='summary', startposition=0,
+               maxrecords=10, callback=None, keep_response=False):
+    """streamed equivalent of catalog.getrecords2()
+
+    catalog.results and catalog.records are populated as getrecords2 does,
+    catalog.response only with keep_response.  callback, if given, is
+    invoked with the results summary and then with each record as soon as
+    it has been parsed.
+    """
+
+    catalog.results = {}
+    catalog.records = OrderedDict()
+
+    for item in iter_records(catalog, constraints, esn, startposition,
+                             maxrecords, keep_response):
+        if isinstance(item, dict):
+            catalog.results = item
+        else:
+            identifier = item.identifier
+            if identifier is None:
+                identifier = 'owslib_random_%i' % random.randint(1, 65536)
+            catalog.records[identifier] = item
+        if callback is not None:
+            callback(item)
+
+    return catalog
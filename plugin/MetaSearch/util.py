@@ -29,19 +29,26 @@ import ConfigParser
 from gettext import gettext, ngettext
 import logging
 import os
+import threading
 import webbrowser
-from xml.dom.minidom import parseString
-import xml.etree.ElementTree as etree
 
-from jinja2 import Environment, FileSystemLoader
-from pygments import highlight
-from pygments.lexers import XmlLexer
-from pygments.formatters import HtmlFormatter
 from PyQt4.QtCore import QCoreApplication
 from PyQt4.QtGui import QMessageBox
 
+from MetaSearch.connections import read_connections
+from MetaSearch.prettyxml import pretty_xml
+
 LOGGER = logging.getLogger('MetaSearch')
 
+# the context shared by the whole plugin, see get_context()
+CONTEXT = None
+CONTEXT_LOCK = threading.Lock()
+
+# XML highlighting, the lexer and the formatter CSS are created on first use
+# and reused across calls
+XML_LEXER = None
+XML_CSS = None
+
 
 class StaticContext(object):
     """base configuration / scaffolding"""
@@ -49,19 +56,79 @@ class StaticContext(object):
     def __init__(self):
         """init"""
         self.ppath = os.path.dirname(os.path.abspath(__file__))
-        self.metadata = ConfigParser.ConfigParser()
-        self.metadata.readfp(open(os.path.join(self.ppath, 'metadata.txt')))
+        self.templates = os.path.join(self.ppath, 'resources', 'templates')
+        self.connections_default = os.path.join(
+            self.ppath, 'resources', 'connections-default.xml')
+        self.bytecode_cache_dir = None
+        self._metadata = None
+        self._environment = None
+        self._lock = threading.Lock()
+
+    @property
+    def metadata(self):
+        """plugin metadata, read from metadata.txt on first access"""
+
+        with self._lock:
+            if self._metadata is None:
+                metadata = ConfigParser.ConfigParser()
+                with open(os.path.join(self.ppath, 'metadata.txt')) as fileobj:
+                    metadata.readfp(fileobj)
+                self._metadata = metadata
+            return self._metadata
+
+    @property
+    def environment(self):
+        """Jinja environment for the plugin templates, created on first use
+
+        The environment compiles each template once and keeps it in memory.
+        """
+
+        # imported on first use, Jinja2 is not needed at QGIS startup
+        from jinja2 import (Environment, FileSystemBytecodeCache,
+                            FileSystemLoader)
+
+        with self._lock:
+            if self._environment is None:
+                bytecode_cache = None
+                if self.bytecode_cache_dir is not None:
+                    if not os.path.exists(self.bytecode_cache_dir):
+                        os.makedirs(self.bytecode_cache_dir)
+                    bytecode_cache = FileSystemBytecodeCache(
+                        self.bytecode_cache_dir)
+
+                # templates ship with the plugin, no need to check for changes
+                env = Environment(extensions=['jinja2.ext.i18n'],
+                                  loader=FileSystemLoader(self.templates),
+                                  auto_reload=False,
+                                  bytecode_cache=bytecode_cache)
+                env.install_gettext_callables(gettext, ngettext,
+                                              newstyle=True)
+                self._environment = env
+            return self._environment
+
+    def set_bytecode_cache(self, directory):
+        """keep compiled templates in directory across sessions"""
+
+        with self._lock:
+            self.bytecode_cache_dir = directory
+            self._environment = None
+
+
+def get_context():
+    """return the StaticContext shared by the whole plugin"""
+
+    global CONTEXT
+
+    with CONTEXT_LOCK:
+        if CONTEXT is None:
+            CONTEXT = StaticContext()
+        return CONTEXT
 
 
 def render_template(language, context, data, template):
     """Renders HTML display of metadata XML"""
 
-    env = Environment(extensions=['jinja2.ext.i18n'],
-                      loader=FileSystemLoader(context.ppath))
-    env.install_gettext_callables(gettext, ngettext, newstyle=True)
-
-    template_file = 'resources/templates/%s' % template
-    template = env.get_template(template_file)
+    template = context.environment.get_template(template)
     return template.render(language=language, obj=data)
 
 
@@ -72,26 +139,22 @@ def translate(text):
 
 
 def get_connections_from_file(parent, filename):
-    """load connections from connection file"""
+    """load connections from connection file
+
+    Returns a list of (name, URL) pairs, or None if the file cannot be
+    read.
+    """
 
-    error = 0
     try:
-        doc = etree.parse(filename).getroot()
-    except etree.ParseError, err:
-        error = 1
+        return read_connections(filename)
+    except SyntaxError, err:
         msg = parent.tr('Cannot parse XML file: %s' % err)
     except IOError, err:
-        error = 1
         msg = parent.tr('Cannot open file: %s' % err)
-
-    if doc.tag != 'qgsCSWConnections':
-        error = 1
+    except ValueError:
         msg = parent.tr('Invalid CSW connections XML.')
 
-    if error == 1:
-        QMessageBox.information(parent, parent.tr('Loading Connections'), msg)
-        return
-    return doc
+    QMessageBox.information(parent, parent.tr('Loading Connections'), msg)
 
 
 def prettify_xml(xml):
@@ -104,21 +167,50 @@ def prettify_xml(xml):
         if xml.startswith('http'):
             return xml
         else:
-            return parseString(xml).toprettyxml()
+            return pretty_xml(xml)
+
+
+def highlight_xml(context, xml, lines=200):
+    """render XML as highlighted HTML, in chunks of lines
+
+    Returns the CSS and a list of HTML fragments: the first is a complete
+    page, the others are blocks to append to it.
+    """
+
+    global XML_LEXER, XML_CSS
+
+    # imported on first use, Pygments is not needed at QGIS startup
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import XmlLexer
+
+    if XML_LEXER is None:
+        XML_CSS = HtmlFormatter().get_style_defs('.highlight')
+        XML_LEXER = XmlLexer()
+
+    # without wrapping, the formatter closes every span at the end of a line
+    body = highlight(prettify_xml(xml), XML_LEXER,
+                     HtmlFormatter(nowrap=True)).splitlines(True)
+    blocks = ['<div class="highlight"><pre>%s</pre></div>' %
+              ''.join(body[i:i + lines])
+              for i in range(0, max(len(body), 1), lines)]
 
+    template = context.environment.get_template('xml_highlight.html')
+    blocks[0] = template.render(css=XML_CSS, body=blocks[0])
+    return XML_CSS, blocks
 
-def highlight_xml(context, xml):
-    """render XML as highlighted HTML"""
 
-    hformat = HtmlFormatter()
-    css = hformat.get_style_defs('.highlight')
-    body = highlight(prettify_xml(xml), XmlLexer(), hformat)
+def format_xml(context, xml, limit):
+    """return (html, text) for display of XML
 
-    env = Environment(loader=FileSystemLoader(context.ppath))
+    Documents up to limit characters are highlighted as HTML, returned as
+    (css, blocks) from highlight_xml, larger ones are only pretty printed
+    and returned as plain text (html is None).
+    """
 
-    template_file = 'resources/templates/xml_highlight.html'
-    template = env.get_template(template_file)
-    return template.render(css=css, body=body)
+    if len(xml) > limit:
+        return None, prettify_xml(xml)
+    return highlight_xml(context, xml), None
 
 
 def open_url(url):
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (C) 2014 Tom Kralidis (tomkralidis@gmail.com)
+#
+# This source is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# This code is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# A copy of the GNU General Public License is available on the World Wide Web
+# at <http://www.gnu.org/copyleft/gpl.html>. You can also obtain it by writing
+# to the Free Software Foundation, Inc., 59 Temple Place - Suite 330, Boston,
+# MA 02111-1307, USA.
+#
+###############################################################################
+
+import logging
+
+from PyQt4.QtCore import QThread, pyqtSignal
+
+LOGGER = logging.getLogger('MetaSearch')
+
+
+class TaskThread(QThread):
+    """run a callable outside of the GUI thread"""
+
+    progress = pyqtSignal(object)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    def __init__(self, func, *args, **kwargs):
+        """init"""
+
+        QThread.__init__(self)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        """execute the callable and report back via signals"""
+
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception, err:
+            LOGGER.debug('Task %s failed: %s', self.func.__name__, err)
+            self.failed.emit(err)
+            return
+
+        self.succeeded.emit(result)
+
+
+class TaskManager(object):
+    """keeps references to running tasks until they have finished
+
+    At most max_tasks tasks run at the same time (0 means no limit), the
+    remainder is queued and started as running tasks finish.
+    """
+
+    def __init__(self, max_tasks=0):
+        """init"""
+
+        self.max_tasks = max_tasks
+        self.tasks = []
+        self.pending = []
+
+    def start(self, func, succeeded, failed, *args, **kwargs):
+        """run func(*args, **kwargs) in a TaskThread and return the thread"""
+
+        return self._start(TaskThread(func, *args, **kwargs), succeeded,
+                           failed)
+
+    def start_streaming(self, func, progress, succeeded, failed, *args):
+        """run func(*args, callback=...) in a TaskThread
+
+        Every value func passes to its callback is delivered to progress
+        in the GUI thread while func is still running.
+        """
+
+        task = TaskThread(func, *args)
+        task.kwargs['callback'] = task.progress.emit
+        task.progress.connect(progress)
+        return self._start(task, succeeded, failed)
+
+    def _start(self, task, succeeded, failed):
+        """start or queue a TaskThread"""
+
+        task.succeeded.connect(succeeded)
+        task.failed.connect(failed)
+        task.finished.connect(lambda: self._remove(task))
+
+        if self.max_tasks and len(self.tasks) >= self.max_tasks:
+            self.pending.append(task)
+        else:
+            self.tasks.append(task)
+            task.start()
+        return task
+
+    def cancel_pending(self):
+        """drop all queued tasks which have not been started yet"""
+
+        self.pending = []
+
+    def wait(self):
+        """drop queued tasks and block until the running ones finish"""
+
+        self.cancel_pending()
+        for task in list(self.tasks):
+            task.wait()
+
+    def running(self):
+        """number of tasks still in flight"""
+
+        return len(self.tasks) + len(self.pending)
+
+    def _remove(self, task):
+        """forget about a finished task and start the next queued one"""
+
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+        if self.pending:
+            task = self.pending.pop(0)
+            self.tasks.append(task)
+            task.start()